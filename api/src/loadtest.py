@@ -0,0 +1,217 @@
+###########################################################################
+# load test for the /ws handler, against the stub providers in stubs.py.
+# every session runs a few turns back to back, a turn lasts from sending
+# the messages to the final assistant event. time to first audio is measured
+# from sending the messages to the first audio frame
+# run with: poetry run python loadtest.py --sessions 1 10 50
+# or, for the prompt size over a long conversation: poetry run python loadtest.py --history 5 200
+###########################################################################
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+import urllib.request
+import uuid
+
+import numpy as np
+
+STUB_PORT = 8001
+API_PORT = 8000
+
+MESSAGES = [
+    {"role": "system", "content": "You are Peach, a helpful home assistant."},
+    {"role": "user", "content": "Hey peach, how are you doing today?"},
+]
+
+
+def _serve_stubs():
+    import stubs
+
+    stubs.serve(STUB_PORT)
+
+
+def _serve_api():
+    import uvicorn
+
+    import main
+
+    uvicorn.run(main.web_app, host="127.0.0.1", port=API_PORT, log_level="warning")
+
+
+async def _wait_for_port(port: int, timeout: float = 30.0):
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            if time.perf_counter() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+
+# one turn, returns the turn latency, the time to first audio in ms (None without audio)
+# and the events the api sent
+async def _turn(ws, payload: dict) -> tuple[float, float | None, list[dict]]:
+    start = time.perf_counter()
+    first_audio = None
+    events = []
+    await ws.send(json.dumps(payload))
+    while True:
+        message = await ws.recv()
+        if isinstance(message, bytes):
+            if first_audio is None:
+                first_audio = (time.perf_counter() - start) * 1000
+            continue
+        events.append(json.loads(message))
+        if events[-1].get("event") in ("turn_end", "no_intent_to_chat"):
+            return (time.perf_counter() - start) * 1000, first_audio, events
+
+
+# runs `turns` turns on one connection,
+# returns the turn latencies and times to first audio in ms
+async def _session(turns: int) -> tuple[list[float], list[float]]:
+    import websockets
+
+    latencies = []
+    first_audio = []
+    payload = dict(
+        session_id=uuid.uuid4().hex, system=MESSAGES[0]["content"], message=MESSAGES[1]
+    )
+    async with websockets.connect(f"ws://127.0.0.1:{API_PORT}/ws") as ws:
+        for _ in range(turns):
+            latency, first_audio_latency, _ = await _turn(ws, payload)
+            latencies.append(latency)
+            if first_audio_latency is not None:
+                first_audio.append(first_audio_latency)
+    return latencies, first_audio
+
+
+# one long conversation, sending the whole history every turn vs only the new turn.
+# prints the prompt size and latency at the turns in `report`
+async def _history(report: list[int]):
+    import websockets
+
+    print(f"{'protocol':>8} {'turn':>6} {'tokens':>8} {'ms':>8}")
+    for protocol in ["history", "session"]:
+        history = [MESSAGES[0]]
+        session_id = uuid.uuid4().hex
+        async with websockets.connect(f"ws://127.0.0.1:{API_PORT}/ws") as ws:
+            for turn in range(1, max(report) + 1):
+                message = dict(role="user", content=f"{MESSAGES[1]['content']} #{turn}")
+                if protocol == "history":
+                    history.append(message)
+                    payload = dict(messages=history)
+                else:
+                    payload = dict(
+                        session_id=session_id,
+                        system=MESSAGES[0]["content"],
+                        message=message,
+                    )
+                latency, _, events = await _turn(ws, payload)
+                if protocol == "history":
+                    reply = next(
+                        e for e in events if e.get("event") == "assistant_response"
+                    )
+                    history.append(dict(role="assistant", content=reply["content"]))
+                if turn in report:
+                    tokens = events[-1].get("context_tokens")
+                    print(f"{protocol:>8} {turn:>6} {tokens:>8} {latency:>8.0f}")
+
+
+async def _run(args: argparse.Namespace):
+    await _wait_for_port(STUB_PORT)
+    await _wait_for_port(API_PORT)
+    if args.history:
+        await _history(args.history)
+        return
+    print(
+        f"{'sessions':>8} {'turns':>6} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} "
+        f"{'ttfa p50':>9} {'ttfa p99':>9} {'failed':>6}"
+    )
+    for sessions in args.sessions:
+        # a session the api couldn't serve, e.g. a connect timeout while its event loop
+        # is blocked, is counted instead of ending the run
+        results = await asyncio.gather(
+            *(_session(args.turns) for _ in range(sessions)), return_exceptions=True
+        )
+        failed = [result for result in results if isinstance(result, BaseException)]
+        results = [
+            result for result in results if not isinstance(result, BaseException)
+        ]
+        if failed:
+            print(f"{len(failed)} sessions failed, first error: {failed[0]!r}")
+        latencies = [latency for result, _ in results for latency in result] or [0]
+        first_audio = [latency for _, result in results for latency in result]
+        # no audio at all is a broken tts, not an instant one
+        ttfa = (
+            [f"{np.percentile(first_audio, q):>9.0f}" for q in (50, 99)]
+            if first_audio
+            else [f"{'-':>9}"] * 2
+        )
+        print(
+            f"{sessions:>8} {len(latencies):>6} {np.percentile(latencies, 50):>8.0f} "
+            f"{np.percentile(latencies, 99):>8.0f} {max(latencies):>8.0f} "
+            f"{ttfa[0]} {ttfa[1]} {len(failed):>6}"
+        )
+    # connections far below requests means the pools are reused across sessions
+    url = f"http://127.0.0.1:{API_PORT}/metrics/pools"
+    with urllib.request.urlopen(url) as response:
+        for name, stats in json.load(response).items():
+            print(
+                f"{name}: {stats['requests']} requests over {stats['connections']} connections"
+            )
+    url = f"http://127.0.0.1:{API_PORT}/metrics/tts"
+    with urllib.request.urlopen(url) as response:
+        stats = json.load(response)
+    print(
+        f"tts: {stats['handshakes']} handshakes, mean {stats['mean_ms']:.0f} ms, "
+        f"{stats['reused']} reused, {stats['saved_ms']:.0f} ms saved"
+    )
+    print(f"tts handshakes: {stats['histogram']}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--turns", type=int, default=5)
+    # e.g. --history 5 200, benchmarks the conversation history instead
+    parser.add_argument("--history", type=int, nargs="+")
+    args = parser.parse_args()
+
+    # the provider clients read their endpoints from the env
+    os.environ.update(
+        OPENAI_API_KEY="stub",
+        OPENAI_BASE_URL=f"http://127.0.0.1:{STUB_PORT}/v1",
+        GROQ_API_KEY="stub",
+        GROQ_BASE_URL=f"http://127.0.0.1:{STUB_PORT}",
+        CARTESIA_API_KEY="stub",
+        CARTESIA_BASE_URL=f"localhost:{STUB_PORT}",
+        ELEVENLABS_API_KEY="stub",
+        CARTESIA_VOICES="stub",
+        VOICES_PATH=os.path.join(tempfile.mkdtemp(), "voices.json"),
+    )
+    # outside of modal the voices are read from a json file
+    with open(os.environ["VOICES_PATH"], "w") as file:
+        json.dump({"stub": {"id": "stub", "embedding": [0.0] * 192}}, file)
+    # the api and the stubs get their own processes, so a blocked event loop
+    # in the handler shows up as latency instead of also stalling the stubs
+    processes = [
+        multiprocessing.Process(target=_serve_stubs, daemon=True),
+        multiprocessing.Process(target=_serve_api, daemon=True),
+    ]
+    for process in processes:
+        process.start()
+    try:
+        asyncio.run(_run(args))
+    finally:
+        for process in processes:
+            process.terminate()
+
+
+if __name__ == "__main__":
+    main()
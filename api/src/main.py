@@ -1,15 +1,625 @@
+import asyncio
 import json
+import re
 import time
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable
 
-import requests
-from fastapi import FastAPI, Response
+from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.websockets import WebSocket
-from modal import Image, asgi_app, Secret, App, Dict
+from modal import Image, asgi_app, Secret, App, Dict, is_local
 
 
 app = App("peach-api")
-web_app = FastAPI()
+
+
+# provider clients and keep-alive http pools, created once per container
+# and shared by every session and tool
+class ClientPool:
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.max_connections = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+        self.max_keepalive_connections = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+        self.transport = CountingTransport(
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive_connections,
+                keepalive_expiry=float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30")),
+            )
+        )
+        self.client = httpx.AsyncClient(
+            transport=self.transport,
+            timeout=httpx.Timeout(60.0, connect=5.0),
+        )
+
+    def stats(self) -> dict:
+        transport = self.transport
+        return dict(
+            requests=transport.requests,
+            connections=transport.connections,
+            in_flight=transport.in_flight,
+            peak_in_flight=transport.peak_in_flight,
+            max_connections=self.max_connections,
+            # above 1 means requests are queued for a connection
+            utilization=transport.in_flight / self.max_connections,
+        )
+
+
+class Clients:
+    def __init__(self) -> None:
+        self.pools = {
+            name: ClientPool(name) for name in ["openai", "groq", "elevenlabs", "tools"]
+        }
+        self.openai = AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            http_client=self.pools["openai"].client,
+        )
+        self.groq = AsyncGroq(
+            api_key=os.getenv("GROQ_API_KEY"),
+            http_client=self.pools["groq"].client,
+        )
+        self.elevenlabs = AsyncElevenLabs(
+            api_key=os.getenv("ELEVENLABS_API_KEY"),
+            httpx_client=self.pools["elevenlabs"].client,
+        )
+        # every open session keeps its own tts websocket, so the connector can't cap
+        # them at the client's default of 10 without stalling the other sessions.
+        # 0 is no limit
+        self.cartesia = AsyncCartesia(
+            api_key=os.environ.get("CARTESIA_API_KEY"),
+            max_num_connections=int(os.getenv("TTS_MAX_CONNECTIONS", "0")),
+        )
+        # plain http for the tools (prodia, open-meteo)
+        self.http = self.pools["tools"].client
+
+    def stats(self) -> dict:
+        return {name: pool.stats() for name, pool in self.pools.items()}
+
+    async def close(self) -> None:
+        await self.cartesia.close()
+        for pool in self.pools.values():
+            await pool.client.aclose()
+
+
+_SENTENCE_END = re.compile(r"[.!?]+[\"')\]]*\s")
+_CLAUSE_END = re.compile(r"[,;:]\s")
+
+
+# cuts streamed llm tokens into fragments that can be spoken on their own.
+# splits after every sentence, and after a clause once there's enough text
+# so the first audio doesn't wait for a long first sentence
+class SentenceSplitter:
+    def __init__(self, min_clause_length: int = 30) -> None:
+        self.min_clause_length = min_clause_length
+        self.text = ""
+
+    def feed(self, token: str) -> list[str]:
+        self.text += token
+        fragments = []
+        while True:
+            match = _SENTENCE_END.search(self.text) or _CLAUSE_END.search(
+                self.text, self.min_clause_length
+            )
+            if match is None:
+                return fragments
+            fragments.append(self.text[: match.end()].strip())
+            self.text = self.text[match.end() :]
+
+    def flush(self) -> list[str]:
+        fragment, self.text = self.text.strip(), ""
+        return [fragment] if fragment else []
+
+
+# what's left to speak once the completion is done and the tools ran.
+# the streamed content was spoken as it arrived, but a model can say something
+# before it calls a tool, so the tool's answer is spoken after it. a reply
+# without content or tool calls gets the fallback
+def unspoken_reply(completion: dict, ai_response: dict) -> str | None:
+    if completion.get("tool_calls") or not completion["content"]:
+        return ai_response["content"]
+    return None
+
+
+# a tool the assistant can call.
+# `run` is a coroutine that gets a `progress` callback and the arguments from the model,
+# `reply` turns its result into (what to say, what to send to the cli)
+class Tool:
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        run: Callable[..., Awaitable[Any]],
+        reply: Callable[[Any], tuple[str, Any]],
+        parameters: dict | None = None,
+        timeout: float = 20.0,
+    ) -> None:
+        self.name = name
+        self.description = description
+        self.run = run
+        self.reply = reply
+        self.parameters = parameters or {}
+        self.timeout = timeout
+
+    def schema(self) -> dict:
+        return {
+            "type": "function",
+            "function": {
+                "name": self.name,
+                "description": self.description,
+                "parameters": self.parameters,
+            },
+        }
+
+
+# runs the tool calls of a completion concurrently, each under its own timeout.
+# progress events ({event: "tool_progress", tool_name, status, ...}) are sent
+# when a tool starts, when it reports progress, and when it ends
+class ToolRegistry:
+    def __init__(self, tools: list[Tool]) -> None:
+        self.tools = {tool.name: tool for tool in tools}
+
+    def schemas(self) -> list[dict]:
+        return [tool.schema() for tool in self.tools.values()]
+
+    async def call_all(
+        self,
+        tool_calls: list[dict],
+        send_progress: Callable[[dict], Awaitable[None]],
+    ) -> list[dict]:
+        return await asyncio.gather(
+            *(self.call(tool_call, send_progress) for tool_call in tool_calls)
+        )
+
+    # returns dict(content, tool_name, tool_res), tool_name is None if the tool failed
+    async def call(
+        self,
+        tool_call: dict,
+        send_progress: Callable[[dict], Awaitable[None]],
+    ) -> dict:
+        name = tool_call["function"]["name"]
+        start_time = time.time()
+
+        async def progress(status: str, **data) -> None:
+            elapsed = round((time.time() - start_time) * 1000)
+            try:
+                await send_progress(
+                    dict(
+                        event="tool_progress",
+                        tool_name=name,
+                        status=status,
+                        elapsed_ms=elapsed,
+                        **data,
+                    )
+                )
+            except Exception as e:
+                print(f"Could not send tool progress: {e}")
+
+        tool = self.tools.get(name)
+        if tool is None:
+            print(f"Unknown tool: {name}")
+            return dict(
+                content="Sorry, I can't do that.", tool_name=None, tool_res=None
+            )
+
+        await progress("started")
+        try:
+            args = json.loads(tool_call["function"]["arguments"] or "{}")
+            print("Calling: ", name, " with args ", args)
+            result = await asyncio.wait_for(
+                tool.run(progress=progress, **args), tool.timeout
+            )
+            print("Function response: ", result)
+            content, tool_res = tool.reply(result)
+        except TimeoutError:
+            print(f"{name} timed out after {tool.timeout}s")
+            await progress("timeout")
+            return dict(
+                content="Sorry, that took too long.", tool_name=None, tool_res=None
+            )
+        except Exception as e:
+            print(f"Error in {name}: {e}")
+            await progress("error")
+            return dict(
+                content="Sorry, something went wrong.", tool_name=None, tool_res=None
+            )
+        await progress("done")
+        print(f"{name} - {round((time.time() - start_time) * 1000)} ms")
+        return dict(content=content, tool_name=name, tool_res=tool_res)
+
+
+# relays pcm_s16le audio from a tts provider to the client in frames of a fixed duration.
+# provider chunks come in any size and can end in the middle of a sample, they're
+# appended to a buffer and every full frame is copied out of it into the bytes the
+# websocket sends. sends are awaited, so a client that reads slowly
+# slows down reading from the provider instead of audio piling up here
+class PCMRelay:
+    def __init__(
+        self, ws: WebSocket, sample_rate: int = 24000, frame_duration_ms: int = 40
+    ) -> None:
+        self.ws = ws
+        # 2 bytes per sample
+        self.frame_size = sample_rate * frame_duration_ms // 1000 * 2
+        self.buffer = bytearray()
+        self.first_frame_time: float | None = None
+
+    async def write(self, chunk: bytes) -> None:
+        self.buffer += chunk
+        while len(self.buffer) >= self.frame_size:
+            frame = bytes(self.buffer[: self.frame_size])
+            # deleting from the front of a bytearray doesn't move the rest
+            del self.buffer[: self.frame_size]
+            await self._send(frame)
+
+    # sends what's left at the end of the audio
+    async def flush(self) -> None:
+        # half a sample can't be played
+        size = len(self.buffer) - len(self.buffer) % 2
+        if size > 0:
+            await self._send(bytes(self.buffer[:size]))
+        if len(self.buffer) % 2 == 1:
+            print("Dropped half a sample at the end of the audio")
+        self.buffer.clear()
+
+    async def _send(self, frame: bytes) -> None:
+        if self.first_frame_time is None:
+            self.first_frame_time = time.time()
+        await self.ws.send_bytes(frame)
+
+
+# how long opening a cartesia websocket takes, and how many were saved by reusing one
+class HandshakeStats:
+    # upper bounds of the histogram buckets, in ms
+    buckets = [25, 50, 100, 200, 400, 800, float("inf")]
+
+    def __init__(self) -> None:
+        self.counts = [0] * len(self.buckets)
+        self.handshakes = 0
+        self.total_time = 0.0
+        self.reused = 0
+
+    def record(self, duration: float) -> None:
+        self.handshakes += 1
+        self.total_time += duration * 1000
+        self.counts[
+            next(i for i, b in enumerate(self.buckets) if duration * 1000 <= b)
+        ] += 1
+
+    def stats(self) -> dict:
+        mean = self.total_time / self.handshakes if self.handshakes else 0.0
+        return dict(
+            handshakes=self.handshakes,
+            histogram={f"<={b}ms": c for b, c in zip(self.buckets, self.counts)},
+            mean_ms=mean,
+            reused=self.reused,
+            # every reuse skips a handshake
+            saved_ms=self.reused * mean,
+        )
+
+
+# one cartesia websocket per /ws session, every reply is a new context on it.
+# the websocket is opened on first use, and again after it failed.
+# the sdk reconnects a closed connection on the next send without telling, so
+# that is done here instead, and only a reply on a connection that was still
+# open counts as a reuse
+class TTSSession:
+    def __init__(self, cartesia: "AsyncCartesia", stats: HandshakeStats) -> None:
+        self.cartesia = cartesia
+        self.stats = stats
+        self.websocket = None
+
+    async def context(self):
+        start_time = time.perf_counter()
+        if self.websocket is None:
+            self.websocket = await self.cartesia.tts.websocket()
+        elif self.websocket.websocket is None or self.websocket.websocket.closed:
+            await self.websocket.connect()
+        else:
+            self.stats.reused += 1
+            return self.websocket.context()
+        self.stats.record(time.perf_counter() - start_time)
+        return self.websocket.context()
+
+    async def close(self) -> None:
+        websocket, self.websocket = self.websocket, None
+        if websocket is not None:
+            try:
+                await websocket.close()
+            except Exception as e:
+                print(f"Error closing the tts websocket: {e}")
+
+
+# cartesia voices that can be used, the first one is the default
+def voice_ids() -> list[str]:
+    return os.getenv(
+        "CARTESIA_VOICES", "5345cf08-6f37-424d-a5d9-8ae1101b9377"  # Maria
+    ).split(",")
+
+
+# cartesia voice embeddings, kept in memory instead of read from the modal dict
+# on every reply. in modal the voices come from the dict filled by cache_models,
+# locally from a json file of {voice_id: voice}.
+# an expired voice is still used while it's reloaded in the background
+class VoiceCache:
+    def __init__(self, ttl: float = 3600.0) -> None:
+        self.ttl = ttl
+        self.path = os.getenv("VOICES_PATH", "voices.json")
+        # voice id -> (load time, embedding)
+        self.voices: dict[str, tuple[float, list[float]]] = {}
+        self.refreshing: set[str] = set()
+        # keeps the refreshes from being garbage collected while they run
+        self.background_tasks: set[asyncio.Task] = set()
+
+    async def load(self, voice_id: str) -> list[float]:
+        if is_local():
+            with open(self.path) as file:
+                voice = json.load(file)[voice_id]
+        else:
+            voice = await globals.get.aio(f"voice:{voice_id}")
+        self.voices[voice_id] = (time.monotonic(), voice["embedding"])
+        return voice["embedding"]
+
+    async def get(self, voice_id: str) -> list[float]:
+        if voice_id not in self.voices:
+            return await self.load(voice_id)
+        loaded_at, embedding = self.voices[voice_id]
+        if time.monotonic() - loaded_at > self.ttl and voice_id not in self.refreshing:
+            self.refreshing.add(voice_id)
+            task = asyncio.create_task(self.load(voice_id))
+            self.background_tasks.add(task)
+            task.add_done_callback(self.background_tasks.discard)
+            task.add_done_callback(lambda task: self._refreshed(voice_id, task))
+        return embedding
+
+    def _refreshed(self, voice_id: str, task: asyncio.Task) -> None:
+        self.refreshing.discard(voice_id)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Could not refresh voice {voice_id}: {task.exception()}")
+
+
+# tool results keyed by name and normalized arguments, each kept for its own ttl.
+# in memory per container, and in a modal dict shared by all containers
+# when RESULT_CACHE_SHARED=true. concurrent misses for the same key run once
+class ResultCache:
+    def __init__(self) -> None:
+        # key -> (expiry, value)
+        self.entries: dict[str, tuple[float, Any]] = {}
+        self.pending: dict[str, asyncio.Task] = {}
+        self.shared = None
+        if not is_local() and os.getenv("RESULT_CACHE_SHARED") == "true":
+            self.shared = Dict.from_name("result-cache", create_if_missing=True)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(name: str, args: dict) -> str:
+        normalized = {
+            k: v.strip().lower() if isinstance(v, str) else v for k, v in args.items()
+        }
+        return f"{name}:{json.dumps(normalized, sort_keys=True)}"
+
+    async def get_or_run(
+        self,
+        name: str,
+        args: dict,
+        ttl: float,
+        run: Callable[[], Awaitable[Any]],
+        should_cache: Callable[[Any], bool] = lambda result: True,
+    ) -> Any:
+        key = self.key(name, args)
+        entry = self.entries.get(key)
+        if entry is None and self.shared is not None:
+            entry = await self.shared.get.aio(key)
+            if entry is not None:
+                self.entries[key] = entry
+        if entry is not None and entry[0] > time.time():
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        if key not in self.pending:
+            self.pending[key] = asyncio.create_task(run())
+            self.pending[key].add_done_callback(lambda _: self.pending.pop(key, None))
+        result = await asyncio.shield(self.pending[key])
+        if should_cache(result):
+            entry = (time.time() + ttl, result)
+            self.entries[key] = entry
+            if self.shared is not None:
+                await self.shared.put.aio(key, entry)
+        return result
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            hit_rate=self.hits / total if total else 0.0,
+            entries=len(self.entries),
+        )
+
+
+# rough token count of a message, about 4 characters per token plus the message overhead
+def count_tokens(message: dict) -> int:
+    return len(message.get("content") or "") // 4 + 4
+
+
+# the history of one session. turns that no longer fit are folded into a
+# rolling summary, so the context sent to the models stays the same size
+class Conversation:
+    def __init__(self, system: str, id: str = "") -> None:
+        self.id = id
+        self.system = system
+        self.summary = ""
+        self.turns: list[dict] = []
+        self.summarizing = False
+        self.last_used = time.time()
+
+    # system prompt + summary + as many of the last `max_turns` messages as fit in `budget`
+    def context(self, budget: int, max_turns: int) -> list[dict]:
+        head = self._head()
+        return head + self._recent(head, budget, max_turns)
+
+    def _head(self) -> list[dict]:
+        messages = [dict(role="system", content=self.system)]
+        if self.summary:
+            messages.append(
+                dict(
+                    role="system",
+                    content=f"Summary of the conversation so far: {self.summary}",
+                )
+            )
+        return messages
+
+    # the last turns that fit in `budget` after `head`, at most `max_turns` of them
+    def _recent(self, head: list[dict], budget: int, max_turns: int) -> list[dict]:
+        used = sum(count_tokens(message) for message in head)
+        recent = []
+        for message in reversed(self.turns[-max_turns:]):
+            used += count_tokens(message)
+            if used > budget:
+                break
+            recent.append(message)
+        return recent[::-1]
+
+    # folds the turns that no longer fit in the context into the summary,
+    # the ones before the last `max_turns` and the ones over the token budget
+    async def summarize(
+        self,
+        budget: int,
+        max_turns: int,
+        summarize: Callable[[str, list[dict]], Awaitable[str]],
+    ) -> None:
+        if self.summarizing:
+            return
+        old = len(self.turns) - len(self._recent(self._head(), budget, max_turns))
+        if old <= 0:
+            return
+        self.summarizing = True
+        try:
+            self.summary = await summarize(self.summary, self.turns[:old])
+            # turns are only ever appended, so the first `old` are still the same
+            del self.turns[:old]
+        except Exception as e:
+            print(f"Could not summarize the conversation: {e}")
+        finally:
+            self.summarizing = False
+
+    def state(self) -> dict:
+        return dict(
+            system=self.system,
+            summary=self.summary,
+            turns=self.turns,
+            last_used=self.last_used,
+        )
+
+    @classmethod
+    def from_state(cls, id: str, state: dict) -> "Conversation":
+        conversation = cls(state["system"], id)
+        conversation.summary = state["summary"]
+        conversation.turns = list(state["turns"])
+        conversation.last_used = state["last_used"]
+        return conversation
+
+
+# the conversations of all sessions, in the memory of the container serving them.
+# in modal every turn is also saved to a modal dict, and a container reads a
+# session from it the first time one of its websockets sends that session id.
+# so a client that reconnects to another container keeps its history, as long as
+# a session only has one websocket open at a time: two containers serving the
+# same session at once would each keep their own copy, and the last save wins.
+# the session id from the client is the only key, so only ids that look like a
+# uuid (the cli sends a uuid4) are kept, any other id gets a history of its own
+# websocket only
+class ConversationStore:
+    def __init__(self) -> None:
+        self.budget = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2000"))
+        self.max_turns = int(os.getenv("CONTEXT_MAX_TURNS", "20"))
+        # sessions unused for this long are dropped
+        self.ttl = 24 * 60 * 60
+        self.conversations: dict[str, Conversation] = {}
+        self.shared = None
+        if not is_local():
+            self.shared = Dict.from_name("conversations", create_if_missing=True)
+
+    @staticmethod
+    def valid_id(session_id: str) -> bool:
+        return re.fullmatch(r"[0-9a-f]{32}|[0-9a-f-]{36}", session_id) is not None
+
+    # `reload` reads the session from the modal dict, where another container
+    # may have saved newer turns
+    async def get(
+        self, session_id: str, system: str, reload: bool = False
+    ) -> Conversation:
+        now = time.time()
+        for id in [
+            id
+            for id, conversation in self.conversations.items()
+            if now - conversation.last_used > self.ttl
+        ]:
+            del self.conversations[id]
+        conversation = self.conversations.get(session_id)
+        if reload and self.shared is not None:
+            try:
+                state = await self.shared.get.aio(session_id)
+            except Exception as e:
+                print(f"Could not load the conversation: {e}")
+                state = None
+            if (
+                state is not None
+                and now - state["last_used"] <= self.ttl
+                and (
+                    conversation is None or state["last_used"] > conversation.last_used
+                )
+            ):
+                conversation = Conversation.from_state(session_id, state)
+        if conversation is None:
+            conversation = Conversation(system, session_id)
+        self.conversations[session_id] = conversation
+        conversation.system = system or conversation.system
+        conversation.last_used = now
+        return conversation
+
+    async def save(self, conversation: Conversation) -> None:
+        if self.shared is None:
+            return
+        try:
+            await self.shared.put.aio(conversation.id, conversation.state())
+        except Exception as e:
+            print(f"Could not save the conversation: {e}")
+
+    # after a turn: saves it, folds what no longer fits into the summary,
+    # and saves again if that changed anything
+    async def update(
+        self,
+        conversation: Conversation,
+        summarize: Callable[[str, list[dict]], Awaitable[str]],
+    ) -> None:
+        await self.save(conversation)
+        turns = len(conversation.turns)
+        await conversation.summarize(self.budget, self.max_turns, summarize)
+        if len(conversation.turns) != turns:
+            await self.save(conversation)
+
+
+@asynccontextmanager
+async def lifespan(web_app: FastAPI):
+    web_app.state.clients = Clients()
+    web_app.state.voices = VoiceCache()
+    web_app.state.tts_handshakes = HandshakeStats()
+    web_app.state.result_cache = ResultCache()
+    web_app.state.conversations = ConversationStore()
+    try:
+        await asyncio.gather(*(web_app.state.voices.load(id) for id in voice_ids()))
+    except Exception as e:
+        # loaded on first use instead
+        print(f"Could not preload voices: {e}")
+    try:
+        yield
+    finally:
+        await web_app.state.clients.close()
+
+
+web_app = FastAPI(lifespan=lifespan)
 origins = [
     "http://localhost:5173",
     "https://getpeachpod.pages.dev",
@@ -32,9 +642,8 @@ def cache_models():
     from cartesia import Cartesia
 
     cartesia = Cartesia(api_key=os.environ.get("CARTESIA_API_KEY"))
-    voice_id = "5345cf08-6f37-424d-a5d9-8ae1101b9377"  # Maria
-    voice = cartesia.voices.get(id=voice_id)
-    globals["voice"] = voice
+    for voice_id in voice_ids():
+        globals[f"voice:{voice_id}"] = cartesia.voices.get(id=voice_id)
 
 
 image = (
@@ -44,16 +653,71 @@ image = (
         "elevenlabs",
         "cartesia",
         "openai",
+        "httpx",
     )
     .run_function(cache_models, secrets=[Secret.from_name(secret_name)])
 )
 
 with image.imports():
     import os
-    from groq import Groq
-    from openai import OpenAI
-    from elevenlabs.client import ElevenLabs
-    from cartesia import Cartesia
+    import httpx
+    from groq import AsyncGroq
+    from openai import AsyncOpenAI
+    from elevenlabs.client import AsyncElevenLabs
+    from cartesia import AsyncCartesia
+
+
+# counts what goes through a `ClientPool` with httpx's transport and trace hooks,
+# the pool's own connection list is private. it's defined here because it needs httpx.
+# a request is in flight from when it's sent until its response is closed,
+# so a streamed completion counts for as long as it streams
+class CountingTransport(httpx.AsyncHTTPTransport):
+    def __init__(self, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.requests = 0
+        # tcp connections opened, far fewer than requests when keep-alive works
+        self.connections = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    async def _trace(self, event: str, info: dict) -> None:
+        if event == "connection.connect_tcp.complete":
+            self.connections += 1
+
+    def _done(self) -> None:
+        self.in_flight -= 1
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        request.extensions = {**request.extensions, "trace": self._trace}
+        try:
+            response = await super().handle_async_request(request)
+        except BaseException:
+            self._done()
+            raise
+        response.stream = ClosingStream(response.stream, self._done)
+        return response
+
+
+# calls `on_close` once when the response body is closed
+class ClosingStream(httpx.AsyncByteStream):
+    def __init__(self, stream: httpx.AsyncByteStream, on_close: Callable) -> None:
+        self.stream = stream
+        self.on_close = on_close
+
+    async def __aiter__(self):
+        async for chunk in self.stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self.stream.aclose()
+        finally:
+            if self.on_close is not None:
+                self.on_close()
+                self.on_close = None
 
 
 @web_app.get("/health")
@@ -61,20 +725,51 @@ def health():
     return Response(status_code=200, content="gucci")
 
 
+@web_app.get("/metrics/pools")
+def pool_metrics(request: Request):
+    return request.app.state.clients.stats()
+
+
+@web_app.get("/metrics/cache")
+def cache_metrics(request: Request):
+    return request.app.state.result_cache.stats()
+
+
+@web_app.get("/metrics/tts")
+def tts_metrics(request: Request):
+    return request.app.state.tts_handshakes.stats()
+
+
 @web_app.websocket("/ws")
 async def transcribe_stream(ws: WebSocket):
-    openai = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-    groq = Groq(api_key=os.getenv("GROQ_API_KEY"))
+    clients: Clients = ws.app.state.clients
+    openai = clients.openai
+    groq = clients.groq
     groq_model = "llama-3.1-70b-versatile"
     groq_small_model = "llama-3.1-8b-instant"
     openai_model = "gpt-4o-mini"
-    elevenlabs = ElevenLabs(api_key=os.getenv("ELEVENLABS_API_KEY"))
-    cartesia = Cartesia(api_key=os.environ.get("CARTESIA_API_KEY"))
+    # start the main completion while the intent is still being classified
+    speculative_intent = os.getenv("SPECULATIVE_INTENT", "true").lower() == "true"
+    elevenlabs = clients.elevenlabs
+    cartesia = clients.cartesia
+    http = clients.http
+    result_cache: ResultCache = ws.app.state.result_cache
+    conversations: ConversationStore = ws.app.state.conversations
+    # keeps the summaries from being garbage collected while they run
+    background_tasks = set()
+    # session ids this websocket has seen, only their first turn reads the modal dict
+    sessions = set()
+    voices: VoiceCache = ws.app.state.voices
+    tts = TTSSession(cartesia, ws.app.state.tts_handshakes)
+    # the client can pick one of the configured voices with ?voice=<id>
+    voice_id = ws.query_params.get("voice", voice_ids()[0])
+    if voice_id not in voice_ids():
+        voice_id = voice_ids()[0]
 
-    def generate_image(prompt):
+    async def generate_image(prompt, progress=None):
         print(f"Generating image {prompt}")
         prodia_key = "72a1b2b6-281a-4211-a658-e7c17780c2d2"
-        response = requests.post(
+        response = await http.post(
             "https://api.prodia.com/v1/sd/generate",
             json={
                 "prompt": prompt,
@@ -102,26 +797,28 @@ async def transcribe_stream(ws: WebSocket):
         while True:
             if num_tries >= 30:
                 return "Image could not be generated"
-            response = requests.get(
+            response = await http.get(
                 f"https://api.prodia.com/v1/job/{job}",
                 headers={"accept": "application/json", "X-Prodia-Key": prodia_key},
             )
             data = response.json()
             print("job: ", data)
             status = data["status"]
+            if progress is not None:
+                await progress("generating_image", job_status=status)
 
             if status == "succeeded":
                 return data["imageUrl"]
 
             num_tries += 1
-            time.sleep(0.5)
+            await asyncio.sleep(0.5)
 
-    def would_you_rather(prompt):
+    async def would_you_rather(prompt, progress=None):
         max_retries = 3
 
         for attempt in range(max_retries):
             try:
-                completion = groq.chat.completions.create(
+                completion = await groq.chat.completions.create(
                     model=groq_model,
                     messages=[
                         {
@@ -158,14 +855,24 @@ async def transcribe_stream(ws: WebSocket):
                 if attempt >= max_retries - 1:
                     return "Sorry, an error occurred."
 
-    def get_weather():
+    async def get_weather(progress=None):
         latitude = "43.6532"
         longitude = "79.3832"
         city = "Toronto"
-        res = requests.get(
-            f"https://api.open-meteo.com/v1/forecast?latitude={latitude}&longitude={longitude}&current=temperature_2m,is_day,rain&forecast_days=1"
+
+        async def fetch_weather():
+            res = await http.get(
+                f"https://api.open-meteo.com/v1/forecast?latitude={latitude}&longitude={longitude}&current=temperature_2m,is_day,rain&forecast_days=1"
+            )
+            return res.json()
+
+        # the weather changes over minutes, not seconds
+        res = await result_cache.get_or_run(
+            "weather",
+            dict(latitude=latitude, longitude=longitude),
+            ttl=600,
+            run=fetch_weather,
         )
-        res = res.json()
         temperature = res["current"]["temperature_2m"]
         is_day = res["current"]["is_day"]
         rain = res["current"]["rain"]
@@ -173,9 +880,19 @@ async def transcribe_stream(ws: WebSocket):
         # words to say
         response = f"It's {temperature} degrees in {city}."
 
-        # generate image
-        image_prompt = f"{city} during the {'night' if is_day == 0 else 'day'} when it is {temperature} degrees {'and raining' if rain == 1 else ''}"
-        image_url = generate_image(image_prompt)
+        # generate image, it needs the weather so it can't start any earlier
+        if progress is not None:
+            await progress("fetched_weather", temperature=temperature)
+        # one image per kind of weather, temperatures in steps of 5 degrees
+        temperature_bucket = round(temperature / 5) * 5
+        image_prompt = f"{city} during the {'night' if is_day == 0 else 'day'} when it is {temperature_bucket} degrees {'and raining' if rain == 1 else ''}"
+        image_url = await result_cache.get_or_run(
+            "weather_image",
+            dict(city=city, is_day=is_day, rain=rain, temperature=temperature_bucket),
+            ttl=24 * 60 * 60,
+            run=lambda: generate_image(image_prompt, progress),
+            should_cache=lambda url: url.startswith("http"),
+        )
 
         return dict(
             response=response,
@@ -183,153 +900,167 @@ async def transcribe_stream(ws: WebSocket):
             image_url=image_url,
         )
 
-    tool_map = dict(
-        generate_image=generate_image,
-        would_you_rather=would_you_rather,
-        get_weather=get_weather,
+    def would_you_rather_reply(result):
+        parsed = json.loads(result)
+        option1 = parsed["option1"]
+        option2 = parsed["option2"]
+        return f"Would you rather {option1.lower()}, or {option2.lower()}", parsed
+
+    tools = ToolRegistry(
+        [
+            Tool(
+                name="would_you_rather",
+                description="Generates a 'would you rather' question",
+                run=would_you_rather,
+                reply=would_you_rather_reply,
+                parameters={
+                    "type": "object",
+                    "properties": {
+                        "prompt": {
+                            "type": "string",
+                            "description": "The prompt to generate the would you rather questions.",
+                        }
+                    },
+                    "required": ["prompt"],
+                },
+                timeout=10.0,
+            ),
+            Tool(
+                name="generate_image",
+                description="Generates an image.",
+                run=generate_image,
+                reply=lambda url: ("Here's your image", url),
+                parameters={
+                    "type": "object",
+                    "properties": {
+                        "prompt": {
+                            "type": "string",
+                            "description": "The prompt to generate the image. Take the user's prompt and expand on it. Try to formulate 2-3 sentences for best results.",
+                        }
+                    },
+                    "required": ["prompt"],
+                },
+                timeout=20.0,
+            ),
+            Tool(
+                name="get_weather",
+                description="Gets the weather for a location.",
+                run=get_weather,
+                reply=lambda weather: (weather["response"], weather),
+                timeout=25.0,
+            ),
+        ]
     )
 
-    def ai(messages) -> dict[str, str]:
+    # streams the main completion, text is cut into fragments and put on `fragments`
+    # as it arrives. returns the whole message, with the tool calls if there are any
+    async def complete(messages, fragments: asyncio.Queue | None = None) -> dict:
         start_time = time.time()
 
-        completion = openai.chat.completions.create(
+        stream = await openai.chat.completions.create(
             model=openai_model,
             messages=messages,
-            tools=[
-                {
-                    "type": "function",
-                    "function": {
-                        "name": "would_you_rather",
-                        "description": "Generates a 'would you rather' question",
-                        "parameters": {
-                            "type": "object",
-                            "properties": {
-                                "prompt": {
-                                    "type": "string",
-                                    "description": "The prompt to generate the would you rather questions.",
-                                }
-                            },
-                            "required": ["prompt"],
-                        },
-                    },
-                },
-                {
-                    "type": "function",
-                    "function": {
-                        "name": "generate_image",
-                        "description": "Generates an image.",
-                        "parameters": {
-                            "type": "object",
-                            "properties": {
-                                "prompt": {
-                                    "type": "string",
-                                    "description": "The prompt to generate the image. Take the user's prompt and expand on it. Try to formulate 2-3 sentences for best results.",
-                                }
-                            },
-                            "required": ["prompt"],
-                        },
-                    },
-                },
-                {
-                    "type": "function",
-                    "function": {
-                        "name": "get_weather",
-                        "description": "Gets the weather for a location.",
-                        "parameters": {},
-                    },
-                },
-            ],
+            stream=True,
+            tools=tools.schemas(),
             tool_choice="auto",
             max_tokens=300,
         )
+        splitter = SentenceSplitter()
+        content = ""
+        tool_calls = {}
+        first_token_time = None
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+            if delta.content:
+                if first_token_time is None:
+                    first_token_time = time.time()
+                    print(
+                        f"ai first token - {round((first_token_time - start_time) * 1000)} ms"
+                    )
+                content += delta.content
+                if fragments is not None:
+                    for fragment in splitter.feed(delta.content):
+                        fragments.put_nowait(fragment)
+            # tool calls arrive in pieces, keyed by their index
+            for tool_call_delta in delta.tool_calls or []:
+                tool_call = tool_calls.setdefault(
+                    tool_call_delta.index,
+                    dict(id="", type="function", function=dict(name="", arguments="")),
+                )
+                if tool_call_delta.id:
+                    tool_call["id"] = tool_call_delta.id
+                if tool_call_delta.function and tool_call_delta.function.name:
+                    tool_call["function"]["name"] += tool_call_delta.function.name
+                if tool_call_delta.function and tool_call_delta.function.arguments:
+                    tool_call["function"][
+                        "arguments"
+                    ] += tool_call_delta.function.arguments
+        if fragments is not None:
+            for fragment in splitter.flush():
+                fragments.put_nowait(fragment)
         end_time = time.time()
         elapsed_time = (end_time - start_time) * 1000
         rounded_time = round(elapsed_time)
         print(f"ai - {rounded_time} ms")
+        completion = dict(role="assistant", content=content)
+        if tool_calls:
+            completion["tool_calls"] = [tool_calls[i] for i in sorted(tool_calls)]
+        return completion
 
-        tool_calls = completion.choices[0].message.tool_calls
+    async def ai(messages, completion=None) -> dict[str, str]:
+        if completion is None:
+            completion = await complete(messages)
+
+        tool_calls = completion.get("tool_calls")
 
         if tool_calls:
-            print("Tool call!")
-            messages.append(completion.choices[0].message.to_dict())
-            tool_call = tool_calls[0]
-            function_name = tool_call.function.name
-            print("Function call: ", function_name)
-            function_to_call = tool_map[function_name]
-            function_args = json.loads(tool_call.function.arguments)
-            print(
-                "Calling: ", function_name, " with args ", tool_call.function.arguments
+            print("Tool calls: ", [call["function"]["name"] for call in tool_calls])
+            messages.append(completion)
+            results = await tools.call_all(tool_calls, ws.send_json)
+            # the cli shows one tool result, the first one that worked
+            succeeded = [result for result in results if result["tool_name"]]
+            first = succeeded[0] if succeeded else results[0]
+            return dict(
+                content=" ".join(result["content"] for result in results),
+                tool_name=first["tool_name"],
+                tool_res=first["tool_res"],
             )
-            function_response = function_to_call(**function_args)
-            print("Function response: ", function_response)
-
-            if function_name == "generate_image":
-                return dict(
-                    content="Here's your image",
-                    tool_name=function_name,
-                    tool_res=function_response,
-                )
-            elif function_name == "would_you_rather":
-                parsed = json.loads(function_response)
-                option1 = parsed["option1"]
-                option2 = parsed["option2"]
-                content = f"Would you rather {option1.lower()}, or {option2.lower()}"
-                return dict(content=content, tool_name=function_name, tool_res=parsed)
-            elif function_name == "get_weather":
-                return dict(
-                    content=function_response["response"],
-                    tool_name=function_name,
-                    tool_res=function_response,
-                )
         else:
             print("No tool call")
-            content = (
-                completion.choices[0].message.content or "Sorry something went wrong."
-            )
+            content = completion["content"] or "Sorry something went wrong."
             return dict(content=content, tool_name=None, tool_res=None)
 
-    async def elevenlabs_speech(ws: WebSocket, ai_response: str):
-        generator = elevenlabs.generate(
-            text=ai_response,
-            voice="Matilda",
-            model="eleven_turbo_v2",
-            output_format="pcm_24000",
-            optimize_streaming_latency=3,
-            stream=True,
-        )
-
-        buffer = bytearray()
-        frame_size = 2  # Since using int16, each frame should be 2 bytes
-
+    # speaks the fragments until None. elevenlabs has no context to append to
+    # over http, so every fragment is its own request on the pooled client
+    async def elevenlabs_speech(
+        ws: WebSocket, fragments: asyncio.Queue
+    ) -> float | None:
+        relay = PCMRelay(ws)
         try:
-            for wav_bytes in generator:
-                buffer.extend(wav_bytes)
-
-                # Send data only when we have complete frames
-                while len(buffer) >= frame_size:
-                    # Determine how many complete frames we can send
-                    send_size = (len(buffer) // frame_size) * frame_size
-                    to_send = bytes(
-                        buffer[:send_size]
-                    )  # Convert to bytes before sending
-                    await ws.send_bytes(to_send)
-                    buffer = buffer[send_size:]  # Remove the sent bytes from buffer
-
-            # After loop, check if there's any leftover data in buffer that can be sent
-            if len(buffer) > 0 and len(buffer) % frame_size == 0:
-                await ws.send_bytes(
-                    bytes(buffer)
-                )  # Convert to bytes and send remaining data
-                buffer.clear()  # Clear the buffer
+            while (ai_response := await fragments.get()) is not None:
+                generator = await elevenlabs.generate(
+                    text=ai_response,
+                    voice="Matilda",
+                    model="eleven_turbo_v2",
+                    output_format="pcm_24000",
+                    optimize_streaming_latency=3,
+                    stream=True,
+                )
+                async for wav_bytes in generator:
+                    await relay.write(wav_bytes)
+            await relay.flush()
         except Exception as e:
             print(
                 f"Error during audio stream generation or WebSocket transmission: {e}"
             )
-        finally:
-            if len(buffer) > 0:
-                print(f"Leftover data in buffer not sent: {len(buffer)} bytes")
+        return relay.first_frame_time
 
-    async def cartesia_speech(ws: WebSocket, ai_response: str):
+    # speaks the fragments until None, all in one cartesia context
+    # so the voice carries over naturally from one fragment to the next.
+    # returns when the first audio was sent
+    async def cartesia_speech(ws: WebSocket, fragments: asyncio.Queue) -> float | None:
         model_id = "sonic-english"
         output_format = {
             "container": "raw",
@@ -337,27 +1068,48 @@ async def transcribe_stream(ws: WebSocket):
             "sample_rate": 24000,
         }
 
-        cartesia_ws = cartesia.tts.websocket()
+        try:
+            voice_embedding = await voices.get(voice_id)
+        except Exception as e:
+            print(f"Could not load voice {voice_id}: {e}")
+            return None
+        relay = PCMRelay(ws)
+        try:
+            context = await tts.context()
+        except Exception as e:
+            print(f"Could not connect to cartesia: {e}")
+            return None
+
+        async def send_fragments():
+            while (fragment := await fragments.get()) is not None:
+                await context.send(
+                    model_id=model_id,
+                    # continuations are concatenated as is
+                    transcript=fragment + " ",
+                    voice_embedding=voice_embedding,
+                    continue_=True,
+                    output_format=output_format,
+                )
+            await context.no_more_inputs()
 
+        sender = asyncio.create_task(send_fragments())
         try:
-            for output in cartesia_ws.send(
-                model_id=model_id,
-                transcript=ai_response,
-                voice_embedding=globals["voice"]["embedding"],
-                stream=True,
-                output_format=output_format,
-            ):
-                buffer = output["audio"]
-                await ws.send_bytes(buffer)
+            async for output in context.receive():
+                await relay.write(output["audio"])
+            await relay.flush()
+            await sender
 
         except Exception as e:
             print(f"Error during audio generation or WebSocket transmission: {e}")
+            # the next reply reconnects
+            await tts.close()
 
         finally:
-            cartesia_ws.close()
+            sender.cancel()
+        return relay.first_frame_time
 
     async def is_user_intent_to_chat(messages) -> bool:
-        completion = groq.chat.completions.create(
+        completion = await groq.chat.completions.create(
             model=groq_small_model,
             messages=[
                 {
@@ -372,23 +1124,82 @@ async def transcribe_stream(ws: WebSocket):
         )
         return completion.choices[0].message.content == "true"
 
+    async def summarize(summary: str, turns: list[dict]) -> str:
+        completion = await groq.chat.completions.create(
+            model=groq_small_model,
+            messages=[
+                {
+                    "role": "system",
+                    "content": "Update the summary of the conversation between the user and the assistant with the new messages. Keep the facts, names and preferences that could matter later. ONLY respond with the summary, in at most 5 sentences.",
+                },
+                {
+                    "role": "user",
+                    "content": f"Summary:\n{summary}\n\nNew messages:\n{json.dumps(turns)}",
+                },
+            ],
+        )
+        return completion.choices[0].message.content
+
     async def core(
         *,
         ws: WebSocket,
         messages,
+        conversation: Conversation | None = None,
     ):
         print("Starting core")
 
         print("messages: ", messages)
 
+        async def timed(coroutine):
+            start_time = time.time()
+            result = await coroutine
+            return result, (time.time() - start_time) * 1000
+
+        # speech = elevenlabs_speech
+        speech = cartesia_speech
+        # spoken text, None when the reply is done
+        fragments = asyncio.Queue()
+        completion_task = None
+        speech_task = None
+        user_has_intent_to_chat = False
         try:
-            user_has_intent_to_chat = await is_user_intent_to_chat(messages)
+            turn_start_time = time.time()
+            if speculative_intent:
+                # the completion is thrown away if the user isn't talking to peach.
+                # tools only run and fragments are only spoken after the intent is known
+                completion_task = asyncio.create_task(
+                    timed(complete(messages, fragments))
+                )
+                # a discarded completion that failed shouldn't log an unretrieved error
+                completion_task.add_done_callback(
+                    lambda task: task.cancelled() or task.exception()
+                )
+            user_has_intent_to_chat, intent_time = await timed(
+                is_user_intent_to_chat(messages)
+            )
             if not user_has_intent_to_chat:
                 print("User does not have intent to chat, returning")
                 await ws.send_json(dict(event="no_intent_to_chat"))
                 return
             print("User has intent to chat, continuing")
-            ai_response = ai(messages)
+            if conversation is not None:
+                conversation.turns.append(messages[-1])
+            # the reply is spoken while it's still being generated
+            speech_task = asyncio.create_task(speech(ws, fragments))
+            if completion_task is None:
+                completion, completion_time = await timed(complete(messages, fragments))
+            else:
+                completion, completion_time = await completion_task
+            turn_time = (time.time() - turn_start_time) * 1000
+            print(
+                f"turn - intent {round(intent_time)} ms, completion {round(completion_time)} ms, "
+                f"total {round(turn_time)} ms, "
+                f"saved {round(intent_time + completion_time - turn_time)} ms"
+            )
+            ai_response = await ai(messages, completion)
+            # tool replies and fallbacks weren't streamed
+            if (reply := unspoken_reply(completion, ai_response)) is not None:
+                fragments.put_nowait(reply)
         except Exception as e:
             print(e)
             ai_response = dict(
@@ -396,14 +1207,61 @@ async def transcribe_stream(ws: WebSocket):
                 tool_name=None,
                 tool_res=None,
             )
+            if speech_task is None:
+                # the intent isn't known, the speculative fragments must not be spoken
+                fragments = asyncio.Queue()
+            fragments.put_nowait(ai_response["content"])
+        finally:
+            if completion_task is not None and not completion_task.done():
+                completion_task.cancel()
 
         print("ai_response: ", ai_response)
-        ai_content = ai_response["content"]
+        if conversation is not None and user_has_intent_to_chat:
+            conversation.turns.append(
+                dict(role="assistant", content=ai_response["content"])
+            )
+            # off the critical path, the next turn uses the new summary if it's ready
+            task = asyncio.create_task(conversations.update(conversation, summarize))
+            background_tasks.add(task)
+            task.add_done_callback(background_tasks.discard)
 
-        # await elevenlabs_speech(ws, ai_content)
-        await cartesia_speech(ws, ai_content)
+        # the reply is known before it's spoken, turn_end repeats it once the audio is
+        # done, which is when the cli updates the ui
+        await ws.send_json(
+            dict(event="assistant_response", role="assistant", **ai_response)
+        )
+        # decided while the reply is spoken, so it's ready when the audio ends
+        continue_listening_task = asyncio.create_task(
+            should_continue_listening(messages, ai_response)
+        )
 
-        completion = groq.chat.completions.create(
+        fragments.put_nowait(None)
+        if speech_task is None:
+            speech_task = asyncio.create_task(speech(ws, fragments))
+        first_audio_time = await speech_task
+        if first_audio_time is not None:
+            print(
+                f"first audio - {round((first_audio_time - turn_start_time) * 1000)} ms"
+            )
+
+        try:
+            continue_listening = await continue_listening_task
+        except Exception as e:
+            print(e)
+            continue_listening = False
+        print("should_continue_listening: ", continue_listening)
+        await ws.send_json(
+            dict(
+                event="turn_end",
+                role="assistant",
+                context_tokens=sum(count_tokens(message) for message in messages),
+                should_continue_listening=continue_listening,
+                **ai_response,
+            )
+        )
+
+    async def should_continue_listening(messages, ai_response) -> bool:
+        completion = await groq.chat.completions.create(
             model=groq_model,
             messages=[
                 {
@@ -421,21 +1279,30 @@ async def transcribe_stream(ws: WebSocket):
                 },
             ],
         )
-        should_continue_listening = completion.choices[0].message.content == "true"
-        print("should_continue_listening: ", should_continue_listening)
-        await ws.send_json(
-            dict(
-                role="assistant",
-                should_continue_listening=should_continue_listening,
-                **ai_response,
-            )
-        )
+        return completion.choices[0].message.content == "true"
 
     try:
         await ws.accept()
 
         while True:
             data = await ws.receive_json()
+            if "message" in data:
+                # the history is kept here, the client only sends the new turn
+                session_id = data.get("session_id", "")
+                if not ConversationStore.valid_id(session_id):
+                    session_id = str(id(ws))
+                conversation = await conversations.get(
+                    session_id,
+                    data.get("system", ""),
+                    reload=session_id not in sessions,
+                )
+                sessions.add(session_id)
+                messages = conversation.context(
+                    conversations.budget, conversations.max_turns
+                )
+                messages.append(data["message"])
+                await core(ws=ws, messages=messages, conversation=conversation)
+                continue
             messages = data.get("messages", [])
             if messages == []:
                 continue
@@ -443,6 +1310,7 @@ async def transcribe_stream(ws: WebSocket):
     except Exception as e:
         print(f"Error: {e}")
     finally:
+        await tts.close()
         await ws.close()
 
 
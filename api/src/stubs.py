@@ -0,0 +1,131 @@
+###########################################################################
+# local stand-ins for the llm and tts providers, for load tests and benchmarks.
+# speaks enough of the openai, groq and cartesia apis for the official clients,
+# point them here with OPENAI_BASE_URL, GROQ_BASE_URL and CARTESIA_BASE_URL
+# run with: poetry run python stubs.py
+###########################################################################
+import asyncio
+import base64
+import json
+import os
+import time
+
+from fastapi import FastAPI, Request, WebSocket
+from fastapi.responses import StreamingResponse
+
+# seconds a completion takes, or until the first token when streaming
+LLM_LATENCY = float(os.getenv("STUB_LLM_LATENCY", "0.3"))
+# seconds between two streamed tokens
+LLM_TOKEN_INTERVAL = float(os.getenv("STUB_LLM_TOKEN_INTERVAL", "0.02"))
+REPLY = (
+    "I'm doing great, thanks for asking! It's a lovely day here, "
+    "and I'm ready to help with whatever you need."
+)
+# seconds between two tts audio chunks, and how many chunks an utterance has
+TTS_CHUNK_INTERVAL = float(os.getenv("STUB_TTS_CHUNK_INTERVAL", "0.02"))
+TTS_CHUNKS = int(os.getenv("STUB_TTS_CHUNKS", "25"))
+# seconds before a tts websocket is accepted, like a tls handshake would take
+TTS_HANDSHAKE = float(os.getenv("STUB_TTS_HANDSHAKE", "0.1"))
+# 20 ms of 24 kHz pcm_s16le
+TTS_CHUNK = bytes(960)
+
+stub_app = FastAPI()
+
+
+def completion(model: str, content: str) -> dict:
+    return {
+        "id": "stub",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+                "logprobs": None,
+            }
+        ],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+    }
+
+
+def completion_chunk(model: str, delta: dict, finish_reason: str | None) -> str:
+    chunk = {
+        "id": "stub",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    return f"data: {json.dumps(chunk)}\n\n"
+
+
+async def stream_reply(model: str):
+    await asyncio.sleep(LLM_LATENCY)
+    yield completion_chunk(model, {"role": "assistant", "content": ""}, None)
+    for token in REPLY.split(" "):
+        await asyncio.sleep(LLM_TOKEN_INTERVAL)
+        yield completion_chunk(model, {"content": token + " "}, None)
+    yield completion_chunk(model, {}, "stop")
+    yield "data: [DONE]\n\n"
+
+
+# openai and groq, every classifier answers "true", streamed completions get REPLY
+@stub_app.post("/v1/chat/completions")
+@stub_app.post("/openai/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    if body.get("stream"):
+        return StreamingResponse(
+            stream_reply(body["model"]), media_type="text/event-stream"
+        )
+    await asyncio.sleep(LLM_LATENCY)
+    return completion(body["model"], "true")
+
+
+# cartesia, streams every transcript back as a fixed number of silent chunks.
+# a context is done after its first input without `continue`
+@stub_app.websocket("/tts/websocket")
+async def tts_websocket(ws: WebSocket):
+    await asyncio.sleep(TTS_HANDSHAKE)
+    await ws.accept()
+    try:
+        while True:
+            request = json.loads(await ws.receive_text())
+            context_id = request.get("context_id")
+            chunks = TTS_CHUNKS if request.get("transcript") else 0
+            for _ in range(chunks):
+                await asyncio.sleep(TTS_CHUNK_INTERVAL)
+                await ws.send_json(
+                    {
+                        "type": "chunk",
+                        "data": base64.b64encode(TTS_CHUNK).decode(),
+                        "done": False,
+                        "status_code": 206,
+                        "step_time": TTS_CHUNK_INTERVAL * 1000,
+                        "context_id": context_id,
+                    }
+                )
+            if request.get("continue"):
+                continue
+            await ws.send_json(
+                {
+                    "type": "done",
+                    "done": True,
+                    "status_code": 206,
+                    "context_id": context_id,
+                }
+            )
+    except Exception:
+        pass
+
+
+def serve(port: int = 8001):
+    import uvicorn
+
+    uvicorn.run(stub_app, host="127.0.0.1", port=port, log_level="warning")
+
+
+if __name__ == "__main__":
+    serve()
@@ -0,0 +1,192 @@
+import asyncio
+import uuid
+
+from main import (
+    ClientPool,
+    Conversation,
+    ConversationStore,
+    HandshakeStats,
+    PCMRelay,
+    TTSSession,
+    unspoken_reply,
+)
+
+
+def test_unspoken_reply():
+    tool_call = dict(
+        id="call_0",
+        type="function",
+        function=dict(name="get_weather", arguments='{"city": "Paris"}'),
+    )
+    weather = dict(content="It's sunny in Paris.", tool_name="get_weather")
+    # the model speaks, then calls the tool
+    mixed = dict(content="Let me check.", tool_calls=[tool_call])
+    assert unspoken_reply(mixed, weather) == "It's sunny in Paris."
+    assert unspoken_reply(dict(content="", tool_calls=[tool_call]), weather) == (
+        "It's sunny in Paris."
+    )
+    chat = dict(content="I'm good, thanks!", tool_name=None)
+    assert unspoken_reply(dict(content="I'm good, thanks!"), chat) is None
+    fallback = dict(content="Sorry something went wrong.", tool_name=None)
+    assert unspoken_reply(dict(content=""), fallback) == fallback["content"]
+
+
+def test_conversation_summarize():
+    async def summarize(summary: str, turns: list[dict]) -> str:
+        return summary + "".join(turn["content"][0] for turn in turns)
+
+    async def run():
+        conversation = Conversation("s")
+
+        def recent():
+            return [m["content"][0] for m in conversation.context(40, 5)[1:]]
+
+        # 10 tokens a turn, the system prompt takes 4
+        conversation.turns = [dict(role="user", content=c * 24) for c in "abcdef"]
+        # the last 3 turns fit in the budget, the first one is past `max_turns`
+        assert recent() == list("def")
+        await conversation.summarize(40, 5, summarize)
+        assert conversation.summary == "abc"
+        # the summary takes room too, what it pushes out is folded in next time
+        assert recent() == list("Sef")
+        await conversation.summarize(40, 5, summarize)
+        assert conversation.summary == "abcd"
+        assert [turn["content"][0] for turn in conversation.turns] == list("ef")
+
+    asyncio.run(run())
+
+
+def test_client_pool_stats():
+    async def handle(reader, writer):
+        # keep-alive, every request gets the same small response
+        while await reader.readuntil(b"\r\n\r\n"):
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok")
+            await writer.drain()
+
+    async def run():
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        url = f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}/"
+        pool = ClientPool("test")
+        for _ in range(3):
+            assert (await pool.client.get(url)).text == "ok"
+        async with pool.client.stream("GET", url) as response:
+            assert pool.stats()["in_flight"] == 1
+            await response.aread()
+        stats = pool.stats()
+        await pool.client.aclose()
+        server.close()
+        return stats
+
+    stats = asyncio.run(run())
+    assert (stats["requests"], stats["connections"]) == (4, 1)
+    assert (stats["in_flight"], stats["peak_in_flight"]) == (0, 1)
+
+
+def test_tts_session_counts_reconnects():
+    class Connection:
+        closed = False
+
+    class Websocket:
+        def __init__(self):
+            self.websocket = Connection()
+
+        async def connect(self):
+            self.websocket = Connection()
+
+        def context(self):
+            return self.websocket
+
+    class Tts:
+        async def websocket(self):
+            return Websocket()
+
+    class Cartesia:
+        tts = Tts()
+
+    async def run():
+        session = TTSSession(Cartesia(), HandshakeStats())
+        first = await session.context()
+        assert await session.context() is first
+        # the connection dropped between replies
+        first.closed = True
+        assert await session.context() is not first
+        return session.stats
+
+    stats = asyncio.run(run())
+    assert (stats.handshakes, stats.reused) == (2, 1)
+
+
+def test_pcm_relay():
+    class Client:
+        def __init__(self):
+            self.frames = []
+
+        async def send_bytes(self, data):
+            assert type(data) is bytes
+            self.frames.append(data)
+
+    async def run(chunks):
+        client = Client()
+        relay = PCMRelay(client, sample_rate=100, frame_duration_ms=100)
+        for chunk in chunks:
+            await relay.write(chunk)
+        await relay.flush()
+        return client.frames
+
+    audio = bytes(range(47))
+    for sizes in [[47], [1] * 47, [3, 19, 1, 24], [20, 20, 7]]:
+        chunks, start = [], 0
+        for size in sizes:
+            chunks.append(audio[start : start + size])
+            start += size
+        frames = asyncio.run(run(chunks))
+        # 20 byte frames, the half sample at the end is dropped
+        assert [len(frame) for frame in frames] == [20, 20, 6]
+        assert b"".join(frames) == audio[:46]
+
+
+def test_conversation_store_shares_sessions():
+    # stands in for the modal dict, `get.aio` and `put.aio`
+    class Method:
+        def __init__(self, aio):
+            self.aio = aio
+
+    class Shared:
+        def __init__(self):
+            self.entries = {}
+
+            async def get(key):
+                return self.entries.get(key)
+
+            async def put(key, value):
+                self.entries[key] = value
+
+            self.get = Method(get)
+            self.put = Method(put)
+
+    async def summarize(summary: str, turns: list[dict]) -> str:
+        return summary + "".join(turn["content"] for turn in turns)
+
+    async def run():
+        shared = Shared()
+        first, second = ConversationStore(), ConversationStore()
+        first.shared = second.shared = shared
+        session_id = uuid.uuid4().hex
+        assert ConversationStore.valid_id(session_id)
+        assert not ConversationStore.valid_id("../other")
+
+        conversation = await first.get(session_id, "s", reload=True)
+        conversation.turns.append(dict(role="user", content="hi"))
+        await first.update(conversation, summarize)
+        # the client reconnected to another container
+        moved = await second.get(session_id, "s", reload=True)
+        assert moved.turns == [dict(role="user", content="hi")]
+        moved.turns.append(dict(role="assistant", content="hello"))
+        await second.update(moved, summarize)
+        # and back, the newer save wins over the copy in memory
+        back = await first.get(session_id, "s", reload=True)
+        assert [turn["content"] for turn in back.turns] == ["hi", "hello"]
+        # later turns on the same websocket don't read the dict
+        assert await first.get(session_id, "s") is back
+
+    asyncio.run(run())
@@ -1,27 +1,42 @@
 ###########################################################################
 # imports
 ###########################################################################
+import time
+
+# before the other imports, so the startup profile includes them
+IMPORTS_STARTED = time.time()
+
+import argparse
 import asyncio
 import ctypes
-from io import BytesIO
 import json
 import multiprocessing
 import os
-import time
-import scipy
+import uuid
 
 import numpy as np
-import sounddevice as sd
 import websockets
 from dotenv import load_dotenv
 import webrtcvad
 
 from realtime_whisper.asr import FasterWhisperASR
-from realtime_whisper.transcriber import LocalAgreement, needs_audio_after, prompt
-from realtime_whisper.audio import Audio, AudioStream, audio_samples_from_file
-from realtime_whisper.core import Transcription
-from setup import check_recording_params, check_api_health
+from realtime_whisper.transcriber import AdaptiveWindow, LocalAgreement
+from realtime_whisper.audio import (
+    AudioBuffer,
+    AudioStream,
+    RingBuffer,
+    SharedMemoryAudioStream,
+    StreamingResampler,
+)
+from realtime_whisper.core import TranscriptArchive, Transcription, to_text
+from realtime_whisper.vad import SpeechTagger
+from setup import check_api_health
 from utils import run_async_worker, check_peach
+from channel import TranscriptionChannel
+from startup import StartupProfile
+from capture import FileCapture, MicrophoneCapture
+from wake_word import WakeWordGate, create_wake_word_detector
+from intent import IntentFilter, default_intent_filter, record_utterance
 from db import db_update_state
 import constants
 from custom_logger import logger
@@ -42,8 +57,8 @@ RECORDER_LOCK = asyncio.Lock()
 HEY_PEACH_DETECTED_LOCK = asyncio.Lock()
 # this event determines when the user is done speaking
 USER_ENDED_SPEAKING_EVENT = asyncio.Event()
-# this event determines when the last audio processed event is set
-LAST_AUDIO_PROCESSED_EVENT = asyncio.Event()
+# the api keeps the conversation history under this id
+SESSION_ID = uuid.uuid4().hex
 
 
 ###########################################################################
@@ -54,114 +69,147 @@ LAST_AUDIO_PROCESSED_EVENT = asyncio.Event()
 # this task will record audio and put it in a queue to be shared between tasks
 async def task_record(
     *,
-    audio_queue: multiprocessing.Queue,
+    audio_stream: AudioStream | SharedMemoryAudioStream,
     last_audio_timestamp: multiprocessing.Value,
+    profile: StartupProfile,
 ) -> None:
-    stream, p = check_recording_params()
+    # reading a file instead of the mic lets the app run without a microphone
+    with profile.phase("mic open"):
+        if os.getenv("SOUND_INPUT_FILE"):
+            capture = FileCapture(os.getenv("SOUND_INPUT_FILE"), repeat=True)
+        else:
+            capture = MicrophoneCapture()
+        capture.start()
+    overflows, dropped = 0, 0
 
     logger.info("Recording started, start speaking!")
 
-    # check recording params and get stream
-
     vad = webrtcvad.Vad(constants.VAD_MODE)
     consecutive_silence_frames = 0
-    audio_stream = AudioStream(audio_queue)
-
-    chunk_buffer = np.array([], dtype=np.float32)
+    # tags how much of each chunk is speech, so the transcription can skip silence
+    speech_tagger = SpeechTagger(constants.VAD_MODE)
+    # resamples from the mic sample rate to 16000 Hz, keeping filter state across frames
+    resampler = StreamingResampler(constants.MIC_SAMPLE_RATE, constants.SAMPLE_RATE)
 
-    while True:
-        # Small sleep to prevent busy-waiting
-        await asyncio.sleep(constants.SLEEP_TIME)
+    # holds the samples until we have a full chunk to send
+    chunk_buffer = RingBuffer(2 * constants.SAMPLE_RATE)
+    # timestamp of the last chunk sent
+    current_time = 0.0
 
-        if RECORDER_LOCK.locked():
-            continue
+    try:
+        while True:
+            # frames keep arriving while the recorder is locked, they are discarded
+            pcm = await capture.read()
 
-        pcm = stream.read(constants.SAMPLES_PER_FRAME, exception_on_overflow=False)
-        if not pcm:
-            continue
+            if capture.overflows > overflows or capture.dropped > dropped:
+                overflows, dropped = capture.overflows, capture.dropped
+                logger.warning(
+                    f"Audio capture fell behind, overflows: {overflows}, dropped frames: {dropped}"
+                )
 
-        pcm_array = np.frombuffer(pcm, dtype=np.int16)
-        # Resample from 44100 Hz to 16000 Hz
-        resampled_pcm = scipy.signal.resample(
-            pcm_array, int(len(pcm_array) * 16000 / 44100)
-        )
-        audio_samples = audio_samples_from_file(
-            BytesIO(resampled_pcm.astype(np.int16).tobytes())
-        )
+            if RECORDER_LOCK.locked():
+                continue
 
-        # Add samples to the chunk buffer
-        chunk_buffer = np.append(chunk_buffer, audio_samples)
-
-        # Check if we have collected 1 second of audio
-        if len(chunk_buffer) >= constants.SAMPLE_RATE:
-            current_time = int(time.time())
-            # Send the 1-second chunk to the audio queue
-            audio_stream.extend(chunk_buffer[: constants.SAMPLE_RATE], current_time)
-            # Keep any remaining samples for the next chunk
-            chunk_buffer = chunk_buffer[constants.SAMPLE_RATE :]
-
-        if HEY_PEACH_DETECTED_LOCK.locked() and not USER_ENDED_SPEAKING_EVENT.is_set():
-            try:
-                # Ensure we have exactly the right number of bytes
-                if len(pcm) != constants.FRAME_SIZE_BYTES:
-                    logger.warning(
-                        f"Unexpected frame size: {len(pcm)} bytes, expected {constants.FRAME_SIZE_BYTES}"
-                    )
-                    continue
+            # Resample from 44100 Hz to 16000 Hz
+            audio_samples = resampler.process(pcm)
+
+            # Add samples to the chunk buffer
+            chunk_buffer.extend(audio_samples)
+            speech_tagger.process(audio_samples)
+
+            # Check if we have collected 1 second of audio
+            if len(chunk_buffer) >= constants.SAMPLE_RATE:
+                current_time = time.time()
+                # Send the 1-second chunk to the audio queue
+                audio_stream.extend(
+                    chunk_buffer.view()[: constants.SAMPLE_RATE],
+                    current_time,
+                    speech_tagger.take(),
+                )
+                # Keep any remaining samples for the next chunk
+                chunk_buffer.drop(constants.SAMPLE_RATE)
 
-                is_speech = vad.is_speech(pcm, constants.SAMPLE_RATE)
+            if (
+                HEY_PEACH_DETECTED_LOCK.locked()
+                and not USER_ENDED_SPEAKING_EVENT.is_set()
+            ):
+                try:
+                    # Ensure we have exactly the right number of bytes
+                    if len(pcm) != constants.FRAME_SIZE_BYTES:
+                        logger.warning(
+                            f"Unexpected frame size: {len(pcm)} bytes, expected {constants.FRAME_SIZE_BYTES}"
+                        )
+                        continue
 
-                if is_speech:
-                    consecutive_silence_frames = 0
-                else:
-                    consecutive_silence_frames += 1
+                    is_speech = vad.is_speech(pcm, constants.SAMPLE_RATE)
 
-                if (
-                    consecutive_silence_frames
-                    >= constants.CONSECUTIVE_SILENCE_THRESHOLD
-                ):
-                    logger.info(
-                        f"🔇 User ended speaking, locking, last timestamp is {current_time}"
-                    )
-                    await RECORDER_LOCK.acquire()
-                    USER_ENDED_SPEAKING_EVENT.set()
-                    last_audio_timestamp.value = current_time
+                    if is_speech:
+                        consecutive_silence_frames = 0
+                    else:
+                        consecutive_silence_frames += 1
+
+                    if (
+                        consecutive_silence_frames
+                        >= constants.CONSECUTIVE_SILENCE_THRESHOLD
+                    ):
+                        await RECORDER_LOCK.acquire()
+
+                        # Send any remaining audio in the buffer
+                        if len(chunk_buffer) > 0:
+                            current_time = time.time()
+                            audio_stream.extend(
+                                chunk_buffer.view(), current_time, speech_tagger.take()
+                            )
+                            chunk_buffer.drop(len(chunk_buffer))
 
-                    # Send any remaining audio in the buffer
-                    if len(chunk_buffer) > 0:
-                        audio_stream.extend(chunk_buffer, current_time)
+                        logger.info(
+                            f"🔇 User ended speaking, locking, last timestamp is {current_time}"
+                        )
+                        last_audio_timestamp.value = current_time
+                        USER_ENDED_SPEAKING_EVENT.set()
 
-            except Exception as e:
-                logger.error(f"Error in VAD processing: {e}")
-                logger.error(f"Frame size: {len(pcm)} bytes")
-                logger.error(f"Frame content (first 10 bytes): {pcm[:10]}")
-                continue  # Skip this frame and continue with the next one
+                except Exception as e:
+                    logger.error(f"Error in VAD processing: {e}")
+                    logger.error(f"Frame size: {len(pcm)} bytes")
+                    logger.error(f"Frame content (first 10 bytes): {pcm[:10]}")
+                    continue  # Skip this frame and continue with the next one
+    finally:
+        capture.close()
 
 
-# this task is responsible for reading from the recorder queue and sending the data to the api
+# this task is responsible for reading the transcription updates and sending the data to the api
 async def task_ws_sender(
     *,
-    shared_transcription: multiprocessing.Value,
+    transcription_channel: TranscriptionChannel,
     ws: websockets.WebSocketClientProtocol,
     last_audio_timestamp: multiprocessing.Value,
 ):
-    processed_transcription = ""
+    # index of the first word that hasn't been sent yet
+    processed = 0
+    # index after the last word the sender has looked at
+    seen = 0
+    intent_filter = default_intent_filter()
 
     try:
         while True:
-            # Pause briefly to avoid blocking the event loop
-            await asyncio.sleep(constants.SLEEP_TIME)
+            # wait for the transcription worker to publish new text
+            updated = await transcription_channel.wait_for_update(
+                seen, timeout=constants.WS_CHECK_INTERVAL
+            )
 
             if ws.closed:
                 logger.info("WebSocket is closed, stopping sender.")
                 break
 
-            if shared_transcription.value == "":
+            if transcription_channel.closed:
+                logger.error("Transcription worker stopped, stopping sender.")
+                break
+
+            if not updated:
                 continue
+            seen = transcription_channel.end
 
-            diff_transcription = shared_transcription.value[
-                len(processed_transcription) :
-            ].strip()
+            diff_transcription = transcription_channel.text_after(processed)
 
             if check_peach(diff_transcription):
                 logger.info("🍑 Hey Peach detected, locking...")
@@ -173,35 +221,58 @@ async def task_ws_sender(
                     "User finished speaking, waiting for latest transcription..."
                 )
 
-                # wait for the last audio processed event
-                # this is a hack to wait for the transcription to finish
-                # should make this event driven but i tried and failed big F
-                await asyncio.sleep(0.8)
+                # wait for the worker to transcribe all the audio before the silence
+                transcribed = await transcription_channel.wait_transcribed(
+                    last_audio_timestamp.value,
+                    timeout=constants.TRANSCRIPTION_TIMEOUT,
+                )
+                if not transcribed:
+                    logger.warning(
+                        f"Transcription did not catch up within {constants.TRANSCRIPTION_TIMEOUT}s"
+                    )
 
-                logger.info(f"Latest transcription: {shared_transcription.value}")
+                logger.info(f"Latest transcription: {transcription_channel.text}")
 
-                diff_transcription = shared_transcription.value[
-                    len(processed_transcription) :
-                ].strip()
-                processed_transcription = shared_transcription.value
+                diff_transcription = transcription_channel.text_after(processed)
+                probabilities = transcription_channel.probabilities_after(processed)
+                processed = seen = transcription_channel.end
 
                 logger.info(f"Diff transcription: {diff_transcription}")
 
                 logger.info("Handling locks...")
                 USER_ENDED_SPEAKING_EVENT.clear()
                 HEY_PEACH_DETECTED_LOCK.release()
-                LAST_AUDIO_PROCESSED_EVENT.clear()
                 last_audio_timestamp.value = 0
 
-                constants.messages.append(
-                    dict(
-                        role="user",
-                        content=diff_transcription,
+                intent = intent_filter.classify(diff_transcription)
+                logger.info(f"Local intent: {intent}")
+                # real transcripts to label, the fixtures are written by hand
+                if os.getenv("INTENT_LOG_PATH"):
+                    record_utterance(
+                        os.getenv("INTENT_LOG_PATH"),
+                        diff_transcription,
+                        probabilities,
+                        intent,
                     )
-                )
+                if intent == IntentFilter.DROP:
+                    # same as the api answering no_intent_to_chat, without the round trip
+                    if RECORDER_LOCK.locked():
+                        RECORDER_LOCK.release()
+                    continue
 
-                await ws.send(json.dumps({"messages": constants.messages}))
-                db_update_state(constants.UIState.PROCESSING.value)
+                # the api keeps the history, only the new turn is sent
+                await ws.send(
+                    json.dumps(
+                        dict(
+                            session_id=SESSION_ID,
+                            system=constants.SYSTEM_PROMPT,
+                            message=dict(role="user", content=diff_transcription),
+                        )
+                    )
+                )
+                await asyncio.to_thread(
+                    db_update_state, constants.UIState.PROCESSING.value
+                )
     except websockets.exceptions.ConnectionClosed as e:
         logger.error(f"WebSocket connection closed unexpectedly: {e}")
     except Exception as e:
@@ -210,10 +281,27 @@ async def task_ws_sender(
         logger.info("Closed websocket sender")
 
 
+# what the ui shows after a reply, the tool's result or idle
+def ui_state(reply: dict) -> str:
+    tool_name = reply.get("tool_name")
+    if tool_name == "generate_image":
+        logger.info(f"Generating image: {reply.get('tool_res')}")
+        return f"{constants.UIState.IMAGE} {reply.get('tool_res')}"
+    if tool_name == "get_weather":
+        logger.info(f"Getting weather: {json.dumps(reply.get('tool_res'))}")
+        return f"get_weather {json.dumps(reply.get('tool_res'))}"
+    if tool_name == "would_you_rather":
+        logger.info(f"Would you rather: {json.dumps(reply.get('tool_res'))}")
+        return f"would_you_rather {json.dumps(reply.get('tool_res'))}"
+    return constants.UIState.IDLING.value
+
+
 async def task_ws_receiver(
     *,
     ws: websockets.WebSocketClientProtocol,
 ) -> None:
+    import sounddevice as sd
+
     logger.info("Inside task ws receiver")
     # this is the sample rate that elevenlabs use
     # i believe cartesia also uses 24k
@@ -248,62 +336,45 @@ async def task_ws_receiver(
                         if RECORDER_LOCK.locked():
                             RECORDER_LOCK.release()
 
-                        # remove the last message that we added,
-                        # since the user does not have intent to chat
-                        constants.messages.pop()
-
                         # continue to the next iteration
                         continue
 
-                    constants.messages.append(
-                        dict(
-                            role="assistant",
-                            content=parsed_data.get("content"),
-                        )
-                    )
+                    if not isinstance(parsed_data, dict):
+                        logger.error(f"Unexpected data structure: {parsed_data}")
+                        continue
 
-                    # we sleep here to give the audio enough time to finish
-                    # obv a hack but it works
-                    await asyncio.sleep(0.8)
+                    # sent while a tool runs
+                    if parsed_data.get("event") == "tool_progress":
+                        if parsed_data.get("status") == "started":
+                            await asyncio.to_thread(
+                                db_update_state, constants.UIState.PROCESSING.value
+                            )
+                        continue
 
-                    # release the recorder lock
-                    if RECORDER_LOCK.locked():
-                        RECORDER_LOCK.release()
+                    # sent as soon as the reply is known, while the audio still plays
+                    if parsed_data.get("event") == "assistant_response":
+                        logger.info(f"Tool name: {parsed_data.get('tool_name')}")
+                        continue
 
-                    if isinstance(parsed_data, dict):
-                        tool_name = parsed_data.get("tool_name")
-                        logger.info(f"Tool name: {tool_name}")
-                        if tool_name == "generate_image":
-                            logger.info(
-                                f"Generating image: {parsed_data.get('tool_res')}"
-                            )
-                            db_update_state(
-                                f"{constants.UIState.IMAGE} {parsed_data.get('tool_res')}"
-                            )
-                        elif tool_name == "get_weather":
-                            logger.info(
-                                f"Getting weather: {json.dumps(parsed_data.get('tool_res'))}"
-                            )
-                            db_update_state(
-                                f"get_weather {json.dumps(parsed_data.get('tool_res'))}"
-                            )
-                        elif tool_name == "would_you_rather":
-                            logger.info(
-                                f"Would you rather: {json.dumps(parsed_data.get('tool_res'))}"
-                            )
-                            db_update_state(
-                                f"would_you_rather {json.dumps(parsed_data.get('tool_res'))}"
-                            )
-                        else:
-                            db_update_state(constants.UIState.IDLING.value)
+                    # sent when the audio is done, with the reply again
+                    if parsed_data.get("event") == "turn_end":
+                        # we sleep here to give the audio enough time to finish
+                        # obv a hack but it works
+                        await asyncio.sleep(0.8)
+
+                        # release the recorder lock
+                        if RECORDER_LOCK.locked():
+                            RECORDER_LOCK.release()
+
+                        # the ui shows the tool result, or goes back to idle, once the
+                        # reply was spoken. the update blocks, so it runs in a thread
+                        await asyncio.to_thread(db_update_state, ui_state(parsed_data))
 
                         should_continue_listening = parsed_data.get(
                             "should_continue_listening"
                         )
                         # if should_continue_listening:
                         #     await ws.send_json(dict(role="user", content=diff_transcription))
-                    else:
-                        logger.error(f"Unexpected data structure: {parsed_data}")
                 except json.JSONDecodeError:
                     logger.error(f"Failed to parse JSON: {data}")
                 except Exception as e:
@@ -322,12 +393,15 @@ async def task_ws_receiver(
 
 async def task_ws_handler(
     *,
-    shared_transcription: multiprocessing.Value,
+    transcription_channel: TranscriptionChannel,
     last_audio_timestamp: multiprocessing.Value,
+    api_ready: multiprocessing.Event,
 ) -> None:
     ws = None
 
     try:
+        # the main process checks the api while this process opens the mic
+        await asyncio.get_running_loop().run_in_executor(None, api_ready.wait)
         logger.info("Creating API WebSocket connection...")
         ws_url = f"wss://{os.getenv('PEACH_API_URL').replace('https://', '')}/ws"
         ws = await websockets.connect(ws_url)
@@ -337,7 +411,7 @@ async def task_ws_handler(
             tg.create_task(
                 task_ws_sender(
                     ws=ws,
-                    shared_transcription=shared_transcription,
+                    transcription_channel=transcription_channel,
                     last_audio_timestamp=last_audio_timestamp,
                 )
             )
@@ -358,105 +432,183 @@ async def task_ws_handler(
 # it's a separate process because it's a cpu intensive task
 # and we want to make sure it doesn't affect the other tasks
 async def worker_transcription(
-    audio_queue: multiprocessing.Queue,
-    shared_transcription: multiprocessing.Value,
-    last_audio_timestamp: multiprocessing.Value,
+    audio_stream: AudioStream | SharedMemoryAudioStream,
+    transcription_channel: TranscriptionChannel,
+    profile: StartupProfile,
 ) -> None:
     logger.info("Running worker transcription!")
 
-    asr = FasterWhisperASR(
-        "tiny.en",
-        vad_filter=True,
-        vad_parameters=dict(min_silence_duration_ms=500),
-    )
+    with profile.phase("model load"):
+        asr = FasterWhisperASR(
+            "tiny.en",
+            vad_filter=True,
+            vad_parameters=dict(min_silence_duration_ms=500),
+        )
+    # the first decode allocates its buffers, better now than on the first words
+    with profile.phase("warmup decode"):
+        asr.warmup()
     local_agreement = LocalAgreement()
-    full_audio = Audio()
-    confirmed = Transcription()
+    # keeps the decoded audio short even when a sentence never ends
+    window = AdaptiveWindow()
+    # only holds the audio after the last confirmed sentence or forced commit
+    full_audio = AudioBuffer()
+    # older words are moved to the transcript log, so memory and the cost of
+    # every update stay the same no matter how long the session runs
+    confirmed = Transcription(
+        max_words=constants.TRANSCRIPT_WINDOW_WORDS,
+        archive=TranscriptArchive(
+            os.getenv("TRANSCRIPT_LOG_PATH", "transcript.jsonl")
+        ),
+    )
+    # whisper only runs once the wake word has been heard
+    with profile.phase("wake word"):
+        wake_word_gate = WakeWordGate(create_wake_word_detector())
+    # speech in the previous chunk
+    last_speech = 0.0
+    asr_invocations = 0
+    skipped_chunks = 0
 
     while True:
-        await asyncio.sleep(constants.SLEEP_TIME)
-
-        item = audio_queue.get()
+        # waits up to SLEEP_TIME for the next chunk
+        item = audio_stream.get(timeout=constants.SLEEP_TIME)
         if item is None:
+            await asyncio.sleep(0)
             continue
 
-        timestamp, chunk = item
+        timestamp, chunk, speech = item
 
         full_audio.extend(chunk)
-        audio = full_audio.after(needs_audio_after(confirmed))
 
-        transcription, _ = await asr.transcribe(audio, prompt(confirmed))
+        # the first silent chunk is still transcribed to confirm the words before it,
+        # after that silence is kept and transcribed along with the next speech.
+        # the short chunk the recorder flushes is never skipped, it ends the utterance
+        silent = (
+            speech == 0 and last_speech == 0 and len(chunk) >= constants.SAMPLE_RATE
+        )
+        last_speech = speech
+        if silent or not wake_word_gate.process(chunk, timestamp):
+            skipped_chunks += 1
+            if not wake_word_gate.is_open(timestamp):
+                # only keep enough audio to transcribe the wake word once it is heard
+                full_audio.trim(full_audio.end - constants.WAKE_WORD_PRE_ROLL)
+            transcription_channel.publish(timestamp)
+            continue
+
+        start = window.commit(confirmed, full_audio.end)
+        full_audio.trim(start)
+        # the short chunk the recorder flushes when the user stops speaking,
+        # and the first silent chunk, confirm the last words so they are never skipped
+        final = speech == 0 or len(chunk) < constants.SAMPLE_RATE
+        if not window.should_decode(start, full_audio.end, force=final):
+            skipped_chunks += 1
+            transcription_channel.publish(timestamp)
+            continue
+
+        audio = full_audio.after(start)
+
+        transcription, _ = await asr.transcribe(audio, window.prompt(confirmed))
+        asr_invocations += 1
+        if asr_invocations % constants.ASR_STATS_INTERVAL == 0:
+            logger.info(
+                f"ASR invocations: {asr_invocations}, skipped chunks: {skipped_chunks}, "
+                f"forced commits: {window.forced_commits}, capped windows: {window.capped}"
+            )
 
         new_words = local_agreement.merge(confirmed, transcription)
         if len(new_words) > 0:
             confirmed.extend(new_words)
-            shared_transcription.value = confirmed.text
-            logger.info(
-                f"Transcription: {confirmed.text} at {timestamp}, last audio timestamp: {last_audio_timestamp.value}"
+            # audio before the last full sentence is never transcribed again
+            full_audio.trim(window.start(confirmed))
+            wake_word_gate.keep_open(timestamp)
+            logger.info(f"Transcription: {to_text(new_words)} at {timestamp}")
+            transcription_channel.publish(
+                timestamp, [(word.text, word.probability) for word in new_words]
             )
-            last_audio_timestamp.value = int(timestamp)
-            if timestamp >= last_audio_timestamp.value:
-                logger.info(
-                    "New transcription is newer than last audio timestamp, setting event"
-                )
-                LAST_AUDIO_PROCESSED_EVENT.set()
+        else:
+            # still let the sender know this audio has been transcribed
+            transcription_channel.publish(timestamp)
 
 
 # this worker (running in a separate process) handles recording and websocket communication
 # now that I'm writing this out, we could have a separate worker for recording and another for websocket
 # NEVERMIND, the reason they're on the same thread is because they're I/O bound not CPU bound
 async def worker_core(
-    audio_queue: multiprocessing.Queue,
-    shared_transcription: multiprocessing.Value,
+    audio_stream: AudioStream | SharedMemoryAudioStream,
+    transcription_channel: TranscriptionChannel,
     last_audio_timestamp: multiprocessing.Value,
+    profile: StartupProfile,
+    api_ready: multiprocessing.Event,
 ) -> None:
     logger.info("Running worker core!")
+    transcription_channel.listen()
+    # only the transcription worker writes, so the pipe ends when it exits
+    transcription_channel.writer.close()
     async with asyncio.TaskGroup() as tg:
         tg.create_task(
             task_ws_handler(
-                shared_transcription=shared_transcription,
+                transcription_channel=transcription_channel,
                 last_audio_timestamp=last_audio_timestamp,
+                api_ready=api_ready,
             )
         )
         tg.create_task(
             task_record(
-                audio_queue=audio_queue,
+                audio_stream=audio_stream,
                 last_audio_timestamp=last_audio_timestamp,
+                profile=profile,
             )
         )
 
 
 def main() -> None:
+    parser = argparse.ArgumentParser(description="Peach")
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help="print how long every startup phase took",
+    )
+    args = parser.parse_args()
+
     logger.info("🍑 Peach\n")
 
-    check_api_health()
+    # the phases run concurrently: the model loads and warms up in the transcription
+    # process, the core process opens the mic, and this process checks the api
+    profile = StartupProfile(origin=IMPORTS_STARTED)
+    profile.record("imports", IMPORTS_STARTED, time.time())
+    # set once the api is up, the core process waits for it before connecting
+    api_ready = multiprocessing.Event()
 
     # create shared variables among processes
-    manager = multiprocessing.Manager()
-    # queue to store a tuple of (timestamp, chunk)
-    audio_queue = manager.Queue()
-    # holds the transcription
-    shared_transcription = manager.Value(ctypes.c_wchar_p, "")
+    # stream of (timestamp, chunk) from the recorder to the transcription worker
+    if os.getenv("AUDIO_TRANSPORT", "shared_memory") == "shared_memory":
+        audio_stream = SharedMemoryAudioStream()
+    else:
+        manager = multiprocessing.Manager()
+        audio_stream = AudioStream(manager.Queue())
+    # transcription updates from the transcription worker to the websocket sender
+    transcription_channel = TranscriptionChannel()
     # holds the timestamp of the last audio chunk before silence is detected after "peach" is detected
-    last_audio_timestamp = manager.Value(ctypes.c_int, 0)
+    last_audio_timestamp = multiprocessing.Value(ctypes.c_double, 0.0)
 
     # define the processes
     p_core = multiprocessing.Process(
         target=run_async_worker,
         args=(
             worker_core,
-            audio_queue,
-            shared_transcription,
+            audio_stream,
+            transcription_channel,
             last_audio_timestamp,
+            profile,
+            api_ready,
         ),
     )
     p_transcription = multiprocessing.Process(
         target=run_async_worker,
         args=(
             worker_transcription,
-            audio_queue,
-            shared_transcription,
-            last_audio_timestamp,
+            audio_stream,
+            transcription_channel,
+            profile,
         ),
     )
 
@@ -464,8 +616,23 @@ def main() -> None:
         logger.info("🚀 Starting processes")
 
         # start the processes
-        p_core.start()
         p_transcription.start()
+        p_core.start()
+        # the processes have their own copies of the pipe
+        transcription_channel.writer.close()
+        transcription_channel.reader.close()
+
+        with profile.phase("api health"):
+            check_api_health()
+        api_ready.set()
+
+        phases = ["model load", "warmup decode", "wake word", "mic open"]
+        if profile.wait(phases):
+            logger.info(f"Ready in {profile.ready:.2f} seconds")
+        else:
+            logger.warning("Not all startup phases finished")
+        if args.profile_startup:
+            logger.info(f"Startup profile:\n{profile.report()}")
 
         # wait for the processes to finish
         p_core.join()
@@ -476,6 +643,7 @@ def main() -> None:
         p_transcription.terminate()
         p_core.join()
         p_transcription.join()
+        audio_stream.unlink()
 
         logger.info("Resources have been cleanly shutdown.")
         logger.info("🏁 Done")
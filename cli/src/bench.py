@@ -0,0 +1,569 @@
+###########################################################################
+# benchmarks for the recording/transcription pipeline
+# run with: poetry run python bench.py <name>
+###########################################################################
+import argparse
+import multiprocessing
+import os
+import time
+from typing import Callable
+
+import numpy as np
+
+import constants
+
+BENCHMARKS: dict[str, Callable[[argparse.Namespace], None]] = {}
+
+
+def benchmark(
+    func: Callable[[argparse.Namespace], None],
+) -> Callable[[argparse.Namespace], None]:
+    BENCHMARKS[func.__name__.removeprefix("bench_")] = func
+    return func
+
+
+# times func once per item, returns (mean, p99) in microseconds
+def _time_per_call(func: Callable, items: list) -> tuple[float, float]:
+    timings = []
+    for item in items:
+        start = time.perf_counter_ns()
+        func(item)
+        timings.append((time.perf_counter_ns() - start) / 1000)
+    return float(np.mean(timings)), float(np.percentile(timings, 99))
+
+
+# 10 seconds of a tone plus noise at the mic sample rate, split into recorder frames
+def _mic_frames(seconds: int = 10) -> list[bytes]:
+    rng = np.random.default_rng(0)
+    t = np.arange(constants.MIC_SAMPLE_RATE * seconds) / constants.MIC_SAMPLE_RATE
+    signal = 8000 * np.sin(2 * np.pi * 440 * t) + rng.normal(0, 500, len(t))
+    pcm = signal.astype(np.int16)
+    size = constants.SAMPLES_PER_FRAME
+    return [pcm[i : i + size].tobytes() for i in range(0, len(pcm) - size, size)]
+
+
+@benchmark
+def bench_resample(args: argparse.Namespace):
+    import scipy.signal
+
+    from realtime_whisper.audio import StreamingResampler
+
+    frames = _mic_frames()
+
+    def fft_resample(pcm: bytes):
+        pcm_array = np.frombuffer(pcm, dtype=np.int16)
+        return scipy.signal.resample(
+            pcm_array, int(len(pcm_array) * constants.SAMPLE_RATE / 44100)
+        )
+
+    # error against resampling the whole recording at once
+    pcm = np.frombuffer(b"".join(frames), dtype=np.int16)
+    offline = scipy.signal.resample_poly(pcm / 32768, 160, 441)
+
+    resampler = StreamingResampler(constants.MIC_SAMPLE_RATE, constants.SAMPLE_RATE)
+
+    for name, func in [
+        ("scipy.signal.resample", lambda pcm: fft_resample(pcm) / 32768),
+        ("StreamingResampler", resampler.process),
+    ]:
+        streamed = np.concatenate([func(frame) for frame in frames])
+        n = min(len(streamed), len(offline)) - 1000
+        error = np.abs(streamed[1000:n] - offline[1000:n]).max()
+
+        mean, p99 = _time_per_call(func, frames)
+        print(
+            f"{name:<24} mean {mean:8.1f} us/frame   p99 {p99:8.1f} us/frame   "
+            f"max error vs offline {error:.5f}"
+        )
+
+
+@benchmark
+def bench_convert(args: argparse.Namespace):
+    from io import BytesIO
+
+    from realtime_whisper.audio import audio_samples_from_file, pcm16_to_float32
+
+    # one resampled 16 kHz frame per recorder frame
+    size = (
+        constants.SAMPLES_PER_FRAME * constants.SAMPLE_RATE // constants.MIC_SAMPLE_RATE
+    )
+    frames = [np.frombuffer(frame, dtype=np.int16)[:size] for frame in _mic_frames()]
+    out = np.empty(size, dtype=np.float32)
+
+    def soundfile_round_trip(pcm):
+        return audio_samples_from_file(BytesIO(pcm.astype(np.int16).tobytes()))
+
+    for name, func in [
+        ("BytesIO + soundfile", soundfile_round_trip),
+        ("pcm16_to_float32", pcm16_to_float32),
+        ("pcm16_to_float32(out=)", lambda pcm: pcm16_to_float32(pcm, out=out)),
+    ]:
+        mean, p99 = _time_per_call(func, frames)
+        print(f"{name:<24} mean {mean:8.2f} us/frame   p99 {p99:8.2f} us/frame")
+
+
+@benchmark
+def bench_append(args: argparse.Namespace):
+    from realtime_whisper.audio import AudioBuffer
+
+    # full_audio in worker_transcription, fed 1 second chunks for 30 minutes
+    # without a confirmed sentence (the worst case for the old np.append path)
+    chunks = [np.zeros(constants.SAMPLE_RATE, dtype=np.float32)] * 30 * 60
+
+    def np_append():
+        data = np.array([], dtype=np.float32)
+        for chunk in chunks:
+            data = np.append(data, chunk)
+            yield data.nbytes
+
+    def audio_buffer():
+        audio = AudioBuffer()
+        for chunk in chunks:
+            audio.extend(chunk)
+            yield audio.ring._data.nbytes
+
+    for name, func in [("np.append", np_append), ("AudioBuffer", audio_buffer)]:
+        timings, nbytes = [], 0
+        start = time.perf_counter_ns()
+        for nbytes in func():
+            timings.append((time.perf_counter_ns() - start) / 1000)
+            start = time.perf_counter_ns()
+        print(
+            f"{name:<12} first minute {np.mean(timings[:60]):8.1f} us/chunk   "
+            f"last minute {np.mean(timings[-60:]):8.1f} us/chunk   "
+            f"memory {nbytes / 1e6:6.1f} MB"
+        )
+
+
+# consumer side of bench_transport, runs in its own process like worker_transcription
+def _transport_consumer(audio_stream, results: multiprocessing.Queue) -> None:
+    latencies = []
+    cpu_start = time.process_time()
+    while True:
+        item = audio_stream.get(timeout=constants.SLEEP_TIME)
+        if item is None:
+            if audio_stream.closed:
+                break
+            continue
+        timestamp, chunk, _ = item
+        chunk.sum()
+        latencies.append((time.perf_counter() - timestamp) * 1000)
+    results.put((latencies, time.process_time() - cpu_start))
+
+
+@benchmark
+def bench_transport(args: argparse.Namespace):
+    from realtime_whisper.audio import AudioStream, SharedMemoryAudioStream
+
+    chunk = np.zeros(constants.SAMPLE_RATE, dtype=np.float32)
+    manager = multiprocessing.Manager()
+
+    for name, audio_stream in [
+        ("Manager().Queue()", AudioStream(manager.Queue())),
+        ("SharedMemoryAudioStream", SharedMemoryAudioStream()),
+    ]:
+        results = multiprocessing.Queue()
+        consumer = multiprocessing.Process(
+            target=_transport_consumer, args=(audio_stream, results)
+        )
+        consumer.start()
+        time.sleep(0.5)
+
+        # 1 second chunks, sent 20x faster than real time
+        cpu_start = time.process_time()
+        for _ in range(200):
+            audio_stream.extend(chunk, time.perf_counter())
+            time.sleep(0.05)
+        producer_cpu = time.process_time() - cpu_start
+        audio_stream.close()
+
+        latencies, consumer_cpu = results.get()
+        consumer.join()
+        audio_stream.unlink()
+        print(
+            f"{name:<24} latency p50 {np.percentile(latencies, 50):6.2f} ms   "
+            f"p99 {np.percentile(latencies, 99):6.2f} ms   "
+            f"cpu producer {producer_cpu * 1000:6.1f} ms   "
+            f"consumer {consumer_cpu * 1000:6.1f} ms"
+        )
+    manager.shutdown()
+
+
+@benchmark
+def bench_sentences(args: argparse.Namespace):
+    from realtime_whisper.core import Transcription, Word, to_full_sentences
+
+    # ten words per sentence, words are confirmed 3 at a time like in a busy session
+    texts = [" word." if i % 10 == 9 else " word" for i in range(12_000)]
+    words = [Word(text=text, start=i, end=i + 0.5) for i, text in enumerate(texts)]
+
+    # what worker_transcription did per chunk before the sentence index
+    def full_scan(confirmed: Transcription):
+        sentences = to_full_sentences(confirmed.words)
+        end = sentences[-1].end if len(sentences) > 0 else 0.0
+        sentences = to_full_sentences(confirmed.words)
+        text = sentences[-1].text if len(sentences) > 0 else None
+        return end, text
+
+    def index(confirmed: Transcription):
+        sentence = confirmed.last_sentence
+        end = sentence.end if sentence is not None else 0.0
+        text = sentence.text if sentence is not None else None
+        return end, text
+
+    for name, func in [("to_full_sentences", full_scan), ("sentence index", index)]:
+        confirmed = Transcription()
+        timings = {}
+        for i in range(0, len(words), 3):
+            start = time.perf_counter_ns()
+            confirmed.extend(words[i : i + 3])
+            func(confirmed)
+            timings[len(confirmed.words)] = (time.perf_counter_ns() - start) / 1000
+        print(
+            f"{name:<18} "
+            + "   ".join(
+                f"{n // 1000}k words {timings[n]:8.1f} us/chunk"
+                for n in [1002, 5001, 10002, 12000]
+            )
+        )
+
+
+# the small fixtures in the repo are synthesized, espeak-ng voices mixed into room noise.
+# they keep the audio benchmarks runnable, numbers that matter need recordings
+AUDIO_FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "audio")
+
+
+def _fixture_files(args: argparse.Namespace, kind: str) -> list[str]:
+    import glob
+
+    files = sorted(
+        path
+        for extension in ["wav", "flac"]
+        for path in glob.glob(os.path.join(args.fixtures, kind, f"*.{extension}"))
+    )
+    if not files:
+        raise SystemExit(f"no {kind} fixtures in {args.fixtures}")
+    return files
+
+
+# reads a fixture as 1 second chunks of 16 kHz float32, like the recorder sends them
+def _fixture_chunks(path: str) -> list[np.ndarray]:
+    import soundfile as sf
+    from scipy.signal import resample_poly
+
+    audio, sample_rate = sf.read(path, dtype="float32", always_2d=True)
+    audio = audio[:, 0]
+    if sample_rate != constants.SAMPLE_RATE:
+        audio = resample_poly(audio, constants.SAMPLE_RATE, sample_rate)
+    audio = audio.astype(np.float32)
+    size = constants.SAMPLE_RATE
+    return [audio[i : i + size] for i in range(0, len(audio), size)]
+
+
+# fixtures: wake/*.wav contain the wake word and other/*.wav are household audio without it.
+# runs the detector configured in the env
+@benchmark
+def bench_wake_word(args: argparse.Namespace):
+    from wake_word import create_wake_word_detector
+
+    if create_wake_word_detector() is None:
+        raise SystemExit("no wake word detector configured")
+    for kind in ["wake", "other"]:
+        files = _fixture_files(args, kind)
+        detections, triggers, cpu, seconds = 0, 0, 0.0, 0.0
+        for path in files:
+            detector = create_wake_word_detector()
+            chunks = _fixture_chunks(path)
+            start = time.process_time()
+            detected = [detector.process(chunk) for chunk in chunks]
+            cpu += time.process_time() - start
+            seconds += sum(len(chunk) for chunk in chunks) / constants.SAMPLE_RATE
+            detections += any(detected)
+            triggers += sum(detected)
+
+        if kind == "wake":
+            print(f"false reject rate {1 - detections / max(len(files), 1):6.1%}")
+        else:
+            print(f"false accept rate {detections / max(len(files), 1):6.1%}")
+            print(
+                f"false accepts     {triggers / max(seconds / 3600, 1e-9):6.1f} per hour"
+            )
+            print(f"idle cpu          {cpu / max(seconds, 1e-9):6.2%} of one core")
+
+
+# fixtures: household/*.wav, long recordings of a normal day at home
+@benchmark
+def bench_vad(args: argparse.Namespace):
+    from realtime_whisper.vad import SpeechTagger
+
+    chunks = [
+        c for path in _fixture_files(args, "household") for c in _fixture_chunks(path)
+    ]
+    hours = sum(len(chunk) for chunk in chunks) / constants.SAMPLE_RATE / 3600
+
+    # same rule as worker_transcription
+    tagger = SpeechTagger(constants.VAD_MODE)
+    transcribed, skipped, last_speech = [], [], 0.0
+    start = time.process_time()
+    for chunk in chunks:
+        tagger.process(chunk)
+        speech = tagger.take()
+        if speech == 0 and last_speech == 0 and len(chunk) >= constants.SAMPLE_RATE:
+            skipped.append(chunk)
+        else:
+            transcribed.append(chunk)
+        last_speech = speech
+    tagger_cpu = time.process_time() - start
+
+    print(f"asr invocations without vad {len(chunks) / hours:8.0f} per hour")
+    print(f"asr invocations with vad    {len(transcribed) / hours:8.0f} per hour")
+    print(f"tagger cpu                  {tagger_cpu / hours:8.1f} s per hour")
+
+    try:
+        from faster_whisper import WhisperModel
+    except ImportError:
+        print("faster_whisper is not installed, skipping the asr cpu estimate")
+        return
+
+    # same model and options as the FasterWhisperASR in app.py, whisper's own vad
+    # already makes silent chunks cheaper, so only the skipped chunks are timed
+    model = WhisperModel(
+        args.model, device="cpu", compute_type="int8_float32", cpu_threads=4
+    )
+    sample = skipped[:: max(len(skipped) // 50, 1)]
+    start = time.process_time()
+    for chunk in sample:
+        segments, _ = model.transcribe(
+            chunk,
+            word_timestamps=True,
+            vad_filter=True,
+            vad_parameters=dict(min_silence_duration_ms=500),
+            max_new_tokens=args.max_new_tokens,
+        )
+        list(segments)
+    per_chunk = (time.process_time() - start) / max(len(sample), 1)
+    saved = len(skipped) * per_chunk - tagger_cpu
+    print(f"asr cpu per skipped chunk   {per_chunk:8.3f} s")
+    print(f"asr cpu saved               {saved / hours:8.1f} s per hour")
+
+
+# the labeled utterances in fixtures/intent.jsonl, with 5-fold cross validation
+# so every utterance is classified by a filter that wasn't trained on it
+@benchmark
+def bench_intent(args: argparse.Namespace):
+    from intent import IntentFilter, load_fixtures
+
+    examples = load_fixtures()
+    order = np.random.default_rng(0).permutation(len(examples))
+    decisions = [""] * len(examples)
+    folds = 5
+    for fold in range(folds):
+        test = order[fold::folds]
+        train = [examples[i] for i in order if i not in test]
+        intent_filter = IntentFilter()
+        intent_filter.fit(train)
+        for i in test:
+            text, _ = examples[i]
+            decisions[i] = intent_filter.classify(text)
+
+    def count(decision: str, intent: bool) -> int:
+        return sum(
+            d == decision and example[1] == intent
+            for d, example in zip(decisions, examples)
+        )
+
+    drops = count(IntentFilter.DROP, True) + count(IntentFilter.DROP, False)
+    positives = sum(example[1] for example in examples)
+    negatives = len(examples) - positives
+    print(f"utterances              {len(examples):6d}")
+    # a dropped utterance is a request the user never gets an answer to
+    print(
+        f"drop precision          {count(IntentFilter.DROP, False) / max(drops, 1):6.1%}"
+    )
+    print(
+        f"false triggers dropped  {count(IntentFilter.DROP, False) / max(negatives, 1):6.1%}"
+    )
+    print(
+        f"requests kept (recall)  {1 - count(IntentFilter.DROP, True) / max(positives, 1):6.1%}"
+    )
+    # dropped ones skip the round trip and the api's classifier
+    print(f"classifier calls saved  {drops / len(examples):6.1%}")
+
+    intent_filter = IntentFilter.from_fixtures()
+    text, _ = examples[0]
+    mean, p99 = _time_per_call(lambda _: intent_filter.classify(text), range(1000))
+    print(f"classify                {mean:6.1f} us mean, {p99:.1f} us p99")
+
+
+# whisper on the audio from `start` to `end`, one word every 0.4 seconds of speech.
+# the word still being spoken comes out differently every decode, like a real decode would
+def _simulated_decode(start: float, end: float, speech: float, decode: int):
+    from realtime_whisper.core import Transcription, Word
+
+    words = []
+    for i in range(int(start / 0.4), int(min(end, speech) / 0.4) + 1):
+        word = Word(f" w{i}", i * 0.4 + 0.05, i * 0.4 + 0.35, 0.9)
+        if word.start < start or word.start >= min(end, speech):
+            continue
+        if word.end > end - 0.3:
+            word.text = f" w{i}-{decode}"
+        words.append(word)
+    return Transcription(words)
+
+
+# one run-on utterance without full stops, streamed in 1 second chunks plus the silent
+# chunk after it. decodes run one after the other, each costs `overhead` per 30 seconds
+# of audio plus `per_second` for every second of the window.
+# returns the real-time factor, mean and max word latency, and the longest window
+def _simulate_transcription(
+    speech: float, adaptive: bool, overhead: float, per_second: float
+) -> tuple[float, float, float, float]:
+    import math
+
+    from realtime_whisper.core import Transcription
+    from realtime_whisper.transcriber import (
+        AdaptiveWindow,
+        LocalAgreement,
+        needs_audio_after,
+    )
+
+    local_agreement = LocalAgreement()
+    window = AdaptiveWindow()
+    confirmed = Transcription()
+    clock, busy, longest = 0.0, 0.0, 0.0
+    latencies = []
+    chunks = math.ceil(speech) + 1
+    for chunk in range(1, chunks + 1):
+        end = float(chunk)
+        if adaptive:
+            start = window.commit(confirmed, end)
+            if not window.should_decode(start, end, force=chunk == chunks):
+                continue
+        else:
+            start = needs_audio_after(confirmed)
+        cost = overhead * math.ceil((end - start) / 30) + per_second * (end - start)
+        clock = max(clock, end) + cost
+        busy += cost
+        longest = max(longest, end - start)
+        incoming = _simulated_decode(start, end, speech, chunk)
+        new_words = local_agreement.merge(confirmed, incoming)
+        confirmed.extend(new_words)
+        latencies.extend(clock - word.end for word in new_words)
+    return busy / speech, float(np.mean(latencies)), max(latencies), longest
+
+
+# decode cost and word latency of the adaptive window against decoding everything
+# after the last full sentence, for utterances that never get a full stop.
+# the decode cost is modeled, see --decode-overhead and --decode-per-second
+@benchmark
+def bench_window(args: argparse.Namespace):
+    print(
+        f"{'window':<9} {'speech s':>8} {'rtf':>6} {'latency ms':>11} "
+        f"{'max ms':>8} {'window s':>9}"
+    )
+    for adaptive in [False, True]:
+        for speech in [5.0, 15.0, 30.0, 60.0]:
+            rtf, latency, max_latency, longest = _simulate_transcription(
+                speech, adaptive, args.decode_overhead, args.decode_per_second
+            )
+            print(
+                f"{'adaptive' if adaptive else 'sentence':<9} {speech:>8.0f} "
+                f"{rtf:>6.2f} {latency * 1000:>11.0f} {max_latency * 1000:>8.0f} "
+                f"{longest:>9.1f}"
+            )
+
+
+# one model serving many audio streams, every stream decodes a 10 second window of
+# friend/audio_15s.mp3 a few times. "sequential" is every stream calling
+# FasterWhisperASR.transcribe on the shared model, "batched" goes through BatchedASREngine.
+# throughput is seconds of audio decoded per second. --model takes a local ctranslate2
+# model directory too, --max-new-tokens caps the tokens decoded per window
+@benchmark
+def bench_asr_streams(args: argparse.Namespace):
+    import asyncio
+
+    try:
+        from faster_whisper import decode_audio
+    except ImportError:
+        print("faster_whisper is not installed, skipping")
+        return
+
+    from realtime_whisper.asr import BatchedASREngine, FasterWhisperASR
+    from realtime_whisper.audio import Audio
+
+    path = os.path.join(os.path.dirname(__file__), "../../friend/audio_15s.mp3")
+    samples = decode_audio(path, sampling_rate=constants.SAMPLE_RATE)
+    window = Audio(samples[: 10 * constants.SAMPLE_RATE])
+    rounds = 3
+    # the batched pipeline decodes without timestamps and never falls back to
+    # higher temperatures, so the sequential decodes don't either
+    asr = FasterWhisperASR(
+        args.model,
+        temperature=0.0,
+        without_timestamps=True,
+        max_new_tokens=args.max_new_tokens,
+    )
+    asr.transcribe_batch([window])
+
+    async def run(backend, streams: int) -> float:
+        async def stream():
+            for _ in range(rounds):
+                await backend.transcribe(window)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(stream() for _ in range(streams)))
+        return streams * rounds * window.duration / (time.perf_counter() - start)
+
+    async def batched(streams: int) -> tuple[float, float]:
+        engine = BatchedASREngine(asr.transcribe_batch, max_batch_size=streams)
+        runner = asyncio.create_task(engine.run())
+        throughput = await run(engine, streams)
+        runner.cancel()
+        return throughput, engine.windows / engine.batches
+
+    print(f"{'streams':>7} {'sequential':>11} {'batched':>9} {'mean batch':>11}")
+    for streams in [1, 2, 4, 8, 16]:
+        sequential = asyncio.run(run(asr, streams))
+        throughput, batch = asyncio.run(batched(streams))
+        print(f"{streams:>7} {sequential:>11.1f} {throughput:>9.1f} {batch:>11.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Peach benchmarks")
+    parser.add_argument("name", choices=[*BENCHMARKS, "all"])
+    parser.add_argument(
+        "--fixtures",
+        default=AUDIO_FIXTURES,
+        help="directory of recorded fixtures, see the benchmarks that use it",
+    )
+    # roughly tiny.en with int8 on a laptop cpu
+    parser.add_argument(
+        "--decode-overhead",
+        type=float,
+        default=0.15,
+        help="seconds per decode and per 30 seconds of audio, for the window benchmark",
+    )
+    parser.add_argument(
+        "--decode-per-second",
+        type=float,
+        default=0.02,
+        help="seconds per decode for every second of audio, for the window benchmark",
+    )
+    parser.add_argument(
+        "--model", default="tiny.en", help="whisper model for the asr benchmarks"
+    )
+    parser.add_argument(
+        "--max-new-tokens",
+        type=int,
+        help="tokens decoded per window at most, for the asr benchmarks",
+    )
+    args = parser.parse_args()
+
+    names = list(BENCHMARKS) if args.name == "all" else [args.name]
+    for name in names:
+        print(f"=== {name} ===")
+        BENCHMARKS[name](args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import asyncio
+import threading
+import time
+from collections import deque
+
+import numpy as np
+import soundfile as sf
+
+import constants
+from custom_logger import logger
+
+
+# microphone capture that never blocks the event loop.
+# the device delivers audio on its own thread, the audio is cut into frames of
+# SAMPLES_PER_FRAME samples and handed to the event loop through a bounded deque.
+# appending/popping a deque is atomic, so the audio thread never waits on a lock,
+# and it only wakes up the event loop when the reader is waiting for a frame
+class AudioCapture:
+    def __init__(self, max_frames: int = constants.CAPTURE_MAX_FRAMES) -> None:
+        self.max_frames = max_frames
+        self.frames: deque[bytes] = deque()
+        # times the device reported an input overflow
+        self.overflows = 0
+        # frames dropped because the reader fell `max_frames` behind
+        self.dropped = 0
+        self._pending = bytearray()
+        self._ready = asyncio.Event()
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+
+    def close(self) -> None:
+        pass
+
+    async def read(self) -> bytes:
+        """Next frame of int16 PCM at MIC_SAMPLE_RATE"""
+        while True:
+            try:
+                return self.frames.popleft()
+            except IndexError:
+                self._ready.clear()
+                # a frame may have arrived before the event was cleared
+                if len(self.frames) == 0:
+                    await self._ready.wait()
+
+    # called from the audio thread
+    def _on_audio(self, pcm: bytes, overflow: bool = False) -> None:
+        if overflow:
+            self.overflows += 1
+        self._pending.extend(pcm)
+        while len(self._pending) >= constants.FRAME_SIZE_BYTES:
+            frame = bytes(self._pending[: constants.FRAME_SIZE_BYTES])
+            del self._pending[: constants.FRAME_SIZE_BYTES]
+            if len(self.frames) >= self.max_frames:
+                try:
+                    self.frames.popleft()
+                    self.dropped += 1
+                except IndexError:
+                    pass
+            self.frames.append(frame)
+        if not self._ready.is_set():
+            self._loop.call_soon_threadsafe(self._ready.set)
+
+
+class MicrophoneCapture(AudioCapture):
+    def start(self) -> None:
+        super().start()
+        # pyaudio is only needed for a real microphone
+        from pyaudio import paContinue, paInputOverflow
+        from setup import check_recording_params
+
+        def callback(in_data, frame_count, time_info, status_flags):
+            self._on_audio(in_data, overflow=bool(status_flags & paInputOverflow))
+            return None, paContinue
+
+        self.stream, self.p = check_recording_params(stream_callback=callback)
+
+    def close(self) -> None:
+        self.stream.stop_stream()
+        self.stream.close()
+        self.p.terminate()
+
+
+# fake device that plays back an audio file, so the recorder can run without a microphone.
+# the file is converted to mono int16, it should already be at MIC_SAMPLE_RATE
+class FileCapture(AudioCapture):
+    def __init__(
+        self,
+        path: str,
+        realtime: bool = True,
+        repeat: bool = False,
+        max_frames: int = constants.CAPTURE_MAX_FRAMES,
+    ) -> None:
+        super().__init__(max_frames)
+        self.path = path
+        self.realtime = realtime
+        self.repeat = repeat
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> None:
+        super().start()
+        self._thread.start()
+
+    def close(self) -> None:
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        pcm, sample_rate = sf.read(self.path, dtype="int16", always_2d=True)
+        if sample_rate != constants.MIC_SAMPLE_RATE:
+            logger.warning(
+                f"{self.path} is {sample_rate} Hz, expected {constants.MIC_SAMPLE_RATE} Hz"
+            )
+        pcm = np.ascontiguousarray(pcm[:, 0])
+        # same buffer size as the microphone stream
+        size = constants.CORRECT_FRAME_LENGTH
+        duration = size / constants.MIC_SAMPLE_RATE
+        next_time = time.perf_counter()
+        while not self._stopped.is_set():
+            for start in range(0, len(pcm), size):
+                if self._stopped.is_set():
+                    return
+                self._on_audio(pcm[start : start + size].tobytes())
+                if self.realtime:
+                    next_time += duration
+                    time.sleep(max(0.0, next_time - time.perf_counter()))
+            if not self.repeat:
+                return
@@ -0,0 +1,107 @@
+import asyncio
+import multiprocessing
+from typing import Callable
+
+import constants
+
+
+# sends transcription updates from the transcription worker to the websocket sender.
+# every chunk the worker processes is acknowledged with a marker that all the audio
+# up to its timestamp is transcribed, along with the newly confirmed words if there are any.
+# words are addressed by their index in the whole transcript, the reader only keeps
+# the last `max_words` of them.
+# the sender awaits updates instead of polling a shared value
+class TranscriptionChannel:
+    def __init__(self, max_words: int = constants.TRANSCRIPT_WINDOW_WORDS) -> None:
+        self.reader, self.writer = multiprocessing.Pipe(duplex=False)
+        self.max_words = max_words
+        # latest state seen by the reader
+        self.words: list[str] = []
+        # whisper's confidence in each word
+        self.probabilities: list[float] = []
+        self.offset = 0
+        self.transcribed_until = 0.0
+        # the worker closed its end of the pipe, nothing more will come
+        self.closed = False
+        # set by the reader callback whenever something arrived
+        self._updated: asyncio.Event | None = None
+
+    @property
+    def end(self) -> int:
+        """Index after the last received word"""
+        return self.offset + len(self.words)
+
+    @property
+    def text(self) -> str:
+        return self.text_after(self.offset)
+
+    def text_after(self, index: int) -> str:
+        return "".join(self.words[max(index - self.offset, 0) :]).strip()
+
+    def probabilities_after(self, index: int) -> list[float]:
+        return self.probabilities[max(index - self.offset, 0) :]
+
+    # called from the transcription worker, `words` are only the new (text, probability)
+    def publish(
+        self, timestamp: float, words: list[tuple[str, float]] | None = None
+    ) -> None:
+        self.writer.send((words, timestamp))
+
+    # called from the websocket sender, waits until there are words after `index`
+    async def wait_for_update(self, index: int, timeout: float | None = None) -> bool:
+        return await self._wait(lambda: self.end > index, timeout)
+
+    # called from the websocket sender, waits until all audio up to `timestamp` is transcribed
+    async def wait_transcribed(
+        self, timestamp: float, timeout: float | None = None
+    ) -> bool:
+        return await self._wait(lambda: self.transcribed_until >= timestamp, timeout)
+
+    # called from the reader's event loop as soon as it runs, so the pipe is drained
+    # from the start and never fills up, which would block the transcription worker
+    def listen(self) -> None:
+        if self._updated is None:
+            self._updated = asyncio.Event()
+            asyncio.get_running_loop().add_reader(self.reader.fileno(), self._receive)
+
+    # the event is only set and cleared on the event loop, so clearing it before
+    # checking the predicate can't miss an update
+    async def _wait(self, predicate: Callable[[], bool], timeout: float | None) -> bool:
+        self.listen()
+        try:
+            async with asyncio.timeout(timeout):
+                while True:
+                    self._updated.clear()
+                    if predicate():
+                        return True
+                    if self.closed:
+                        return False
+                    await self._updated.wait()
+        except TimeoutError:
+            return False
+
+    def _receive(self) -> None:
+        try:
+            while self.reader.poll():
+                words, timestamp = self.reader.recv()
+                if words:
+                    self.words.extend(text for text, _ in words)
+                    self.probabilities.extend(probability for _, probability in words)
+                    if len(self.words) > self.max_words:
+                        dropped = len(self.words) - self.max_words
+                        del self.words[:dropped]
+                        del self.probabilities[:dropped]
+                        self.offset += dropped
+                self.transcribed_until = max(self.transcribed_until, timestamp)
+        except EOFError:
+            self.close()
+        self._updated.set()
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        if self._updated is not None:
+            asyncio.get_running_loop().remove_reader(self.reader.fileno())
+            self._updated.set()
+        self.reader.close()
@@ -8,13 +8,20 @@ MIC_SAMPLE_RATE = 44100  # sample rate of the mic
 FRAME_DURATION_MS = 30
 SAMPLES_PER_FRAME = int(SAMPLE_RATE * FRAME_DURATION_MS / 1000)
 FRAME_SIZE_BYTES = SAMPLES_PER_FRAME * 2  # 2 bytes per sample for 16-bit audio
+CAPTURE_MAX_FRAMES = 100  # frames buffered between the audio thread and the event loop
 VAD_MODE = 1
+ASR_STATS_INTERVAL = 100  # log the asr invocation counts every N invocations
 CONSECUTIVE_SILENCE_THRESHOLD = 20
+WAKE_WORD_PRE_ROLL = 3.0  # seconds of audio before the wake word that get transcribed
+WAKE_WORD_HOLD = 10.0  # seconds the transcription keeps running after the last words
+WS_CHECK_INTERVAL = 1.0  # how often the sender checks the websocket when idle
+TRANSCRIPTION_TIMEOUT = 5.0  # max wait for the transcription to catch up after speaking
+# confirmed words kept in memory, older ones are archived
+TRANSCRIPT_WINDOW_WORDS = 1000
+INTENT_DROP_BELOW = 0.2  # utterances less likely than this to be a request are dropped
 
-messages = [
-    {
-        "role": "system",
-        "content": """You are Peach, a helpful home assistant.
+# the api keeps the conversation, the system prompt is sent along with every turn
+SYSTEM_PROMPT = """You are Peach, a helpful home assistant.
 
 Instructions:
 You will be speaking back to the user via audio, so be conversational and imagine the words you choose to say as being spoken back to the user. 
@@ -25,9 +32,7 @@ If the user asks to be dirty, don"t be shy and be dirty!
 ONLY RESPOND WITH THE ANSWER TO THE USER"S REQUEST. DO NOT ADD UNNECESSARY INFORMATION.
 
 ONLY call generate_image the function when the user specifically asks to create an image. Otherwise, do not call any tool.
-""",
-    }
-]
+"""
 
 
 class UIState(Enum):
@@ -0,0 +1,139 @@
+import json
+import os
+import re
+from functools import cache
+
+import numpy as np
+from numpy.typing import NDArray
+
+import constants
+
+FIXTURES_PATH = os.path.join(os.path.dirname(__file__), "fixtures", "intent.jsonl")
+
+_WORD = re.compile(r"[a-z']+")
+_GREETINGS = {"hey", "hi", "hello", "ok", "okay", "yo", "so"}
+# words before "peach" that make it the fruit, a color or a name, not the assistant
+_DETERMINERS = {"a", "the", "my", "your", "this", "that", "some", "any", "of", "is"}
+_QUESTION_WORDS = {
+    "what",
+    "what's",
+    "who",
+    "why",
+    "how",
+    "when",
+    "where",
+    "which",
+    "can",
+    "could",
+    "do",
+    "is",
+    "are",
+    "will",
+    "tell",
+    "give",
+    "make",
+    "draw",
+    "generate",
+    "say",
+    "help",
+}
+
+
+# what the classifier looks at in an utterance, all roughly in [0, 1].
+# only the text, there are no labeled transcripts with whisper's word
+# probabilities yet, see `record_utterance`
+def features(text: str) -> NDArray[np.float64]:
+    words = _WORD.findall(text.lower())
+    if "peach" not in words:
+        return np.zeros(7)
+    first = words.index("peach")
+    last = len(words) - 1 - words[::-1].index("peach")
+    before = words[first - 1] if first > 0 else ""
+    after = [word for word in words[last + 1 :] if word != "peach"]
+    return np.array(
+        [
+            # addressed at the start of the utterance, maybe after a greeting
+            float(first == 0 or (first == 1 and before in _GREETINGS)),
+            float(before in _GREETINGS),
+            float(before in _DETERMINERS),
+            min(len(after), 8) / 8,
+            float(len(after) > 0 and after[0] in _QUESTION_WORDS),
+            float(text.rstrip().endswith("?")),
+            # repeating the wake word is usually a hallucination
+            float(words.count("peach") > 1),
+        ]
+    )
+
+
+def _sigmoid(x: NDArray[np.float64]) -> NDArray[np.float64]:
+    return 1 / (1 + np.exp(-x))
+
+
+# cheap intent check that runs before the transcription is sent to the api.
+# obvious false triggers are dropped without a round trip, everything else is
+# escalated to the api, whose classifier has the final say.
+# a logistic regression over `features`, trained on the labeled fixtures
+class IntentFilter:
+    DROP = "drop"
+    ESCALATE = "escalate"
+
+    def __init__(self, drop_below: float = constants.INTENT_DROP_BELOW) -> None:
+        self.drop_below = drop_below
+        self.weights = np.zeros(7)
+        self.bias = 0.0
+
+    @classmethod
+    def from_fixtures(cls, path: str = FIXTURES_PATH, **kwargs) -> "IntentFilter":
+        intent_filter = cls(**kwargs)
+        intent_filter.fit(load_fixtures(path))
+        return intent_filter
+
+    def fit(
+        self,
+        examples: list[tuple[str, bool]],
+        steps: int = 2000,
+        learning_rate: float = 0.5,
+        l2: float = 0.01,
+    ) -> None:
+        x = np.array([features(text) for text, _ in examples])
+        y = np.array([intent for _, intent in examples], dtype=np.float64)
+        for _ in range(steps):
+            error = _sigmoid(x @ self.weights + self.bias) - y
+            self.weights -= learning_rate * (x.T @ error / len(y) + l2 * self.weights)
+            self.bias -= learning_rate * error.mean()
+
+    def probability(self, text: str) -> float:
+        return float(_sigmoid(features(text) @ self.weights + self.bias))
+
+    def classify(self, text: str) -> str:
+        words = _WORD.findall(text.lower())
+        # nothing but the wake word, and not even a greeting
+        if all(word == "peach" for word in words):
+            return self.DROP
+        probability = self.probability(text)
+        if probability < self.drop_below:
+            return self.DROP
+        return self.ESCALATE
+
+
+# fitted once per process, the fixtures don't change while it runs
+@cache
+def default_intent_filter() -> IntentFilter:
+    return IntentFilter.from_fixtures()
+
+
+# (text, intent), hand written utterances
+def load_fixtures(path: str = FIXTURES_PATH) -> list[tuple[str, bool]]:
+    with open(path) as file:
+        examples = [json.loads(line) for line in file if line.strip()]
+    return [(example["text"], example["intent"]) for example in examples]
+
+
+# appends an utterance the filter saw to a jsonl file, with whisper's word
+# probabilities, so real transcripts can be labeled and added to the fixtures
+def record_utterance(
+    path: str, text: str, probabilities: list[float], decision: str
+) -> None:
+    with open(path, "a") as file:
+        line = dict(text=text, probabilities=probabilities, decision=decision)
+        file.write(json.dumps(line) + "\n")
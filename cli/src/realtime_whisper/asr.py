@@ -1,28 +1,64 @@
+from __future__ import annotations
+
 import asyncio
+import bisect
 import time
-from typing import Iterable
+from typing import TYPE_CHECKING, Any, Callable, Iterable, Protocol
 
-from faster_whisper import transcribe, WhisperModel
+import numpy as np
 
 from realtime_whisper.audio import Audio
+from realtime_whisper.config import SAMPLES_PER_SECOND
 from realtime_whisper.core import Transcription, Word
 from custom_logger import logger
 
+if TYPE_CHECKING:
+    from faster_whisper import transcribe
+
+
+# what the transcriber needs from a speech recognizer.
+# the prompt is a hint, a backend may ignore it: `BatchedASREngine` decodes every
+# window of a batch without one, so text before the window doesn't carry over
+class ASRBackend(Protocol):
+    async def transcribe(
+        self,
+        audio: Audio,
+        prompt: str | None = None,
+    ) -> tuple[Transcription, Any]: ...
+
 
 class FasterWhisperASR:
     def __init__(
         self,
         whisper_model: str,
+        device: str = "cpu",
+        compute_type: str = "int8_float32",
+        cpu_threads: int = 4,
+        num_workers: int = 2,
         **kwargs,
     ) -> None:
+        from faster_whisper import WhisperModel
+
         self.whisper = WhisperModel(
             whisper_model,
-            device="cpu",
-            compute_type="int8_float32",
-            cpu_threads=4,
-            num_workers=2,
+            device=device,
+            compute_type=compute_type,
+            cpu_threads=cpu_threads,
+            num_workers=num_workers,
         )
         self.transcribe_opts = kwargs
+        self.batched = None
+
+    def warmup(self, duration: float = 1.0) -> None:
+        """One decode of synthetic audio, so the first real decode doesn't pay for the allocations"""
+        rng = np.random.default_rng(0)
+        t = np.arange(int(duration * SAMPLES_PER_SECOND)) / SAMPLES_PER_SECOND
+        audio = 0.1 * np.sin(2 * np.pi * 220 * t) + rng.normal(0, 0.01, len(t))
+        # without the vad, so the decoder runs too
+        segments, _ = self.whisper.transcribe(
+            audio.astype(np.float32), word_timestamps=True, vad_filter=False
+        )
+        list(segments)
 
     def _transcribe(
         self,
@@ -61,6 +97,100 @@ class FasterWhisperASR:
             prompt,
         )
 
+    def transcribe_batch(self, audios: list[Audio]) -> list[Transcription]:
+        """Decode windows of different streams in one call, with faster-whisper 1.1"""
+        from faster_whisper import BatchedInferencePipeline
+
+        if self.batched is None:
+            self.batched = BatchedInferencePipeline(model=self.whisper)
+        # the windows are laid end to end and cut apart again by `clip_timestamps`,
+        # every clip is one item of the batch. faster-whisper 1.1 takes the clips
+        # in samples, the words come back in seconds of the concatenated audio
+        ends = np.cumsum([len(audio.data) for audio in audios])
+        clips = [
+            dict(start=int(end) - len(audio.data), end=int(end))
+            for end, audio in zip(ends, audios)
+        ]
+        starts = [clip["start"] / SAMPLES_PER_SECOND for clip in clips]
+        # the clips replace whisper's own vad
+        opts = {
+            k: v for k, v in self.transcribe_opts.items() if not k.startswith("vad")
+        }
+        segments, _ = self.batched.transcribe(
+            np.concatenate([audio.data for audio in audios]),
+            clip_timestamps=clips,
+            batch_size=len(audios),
+            word_timestamps=True,
+            **opts,
+        )
+        words: list[list[Word]] = [[] for _ in audios]
+        for word in words_from_whisper_segments(segments):
+            i = bisect.bisect_right(starts, word.start) - 1
+            word.offset(audios[i].start - starts[i])
+            words[i].append(word)
+        return [Transcription(w) for w in words]
+
+
+# one model shared by many audio streams, so one box can serve many rooms.
+# windows from different streams that wait for a decode at the same time are
+# decoded together, the fixed cost of a decode is paid once per batch instead of
+# once per stream. start `run` as a task, then every stream calls `transcribe`
+class BatchedASREngine:
+    def __init__(
+        self,
+        decode_batch: Callable[[list[Audio]], list[Transcription]],
+        max_batch_size: int = 8,
+        max_wait: float = 0.02,
+    ) -> None:
+        self.decode_batch = decode_batch
+        self.max_batch_size = max_batch_size
+        # how long a window waits for others to join its batch
+        self.max_wait = max_wait
+        self.pending: asyncio.Queue[tuple[Audio, asyncio.Future]] = asyncio.Queue()
+        self.batches = 0
+        self.windows = 0
+
+    async def transcribe(
+        self,
+        audio: Audio,
+        prompt: str | None = None,
+    ) -> tuple[Transcription, None]:
+        """Decode the window in the next batch, batched decodes don't take a prompt"""
+        future = asyncio.get_running_loop().create_future()
+        await self.pending.put((audio, future))
+        return await future, None
+
+    async def run(self) -> None:
+        """Decode the pending windows in batches, until cancelled"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.pending.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                try:
+                    batch.append(
+                        await asyncio.wait_for(
+                            self.pending.get(), max(deadline - loop.time(), 0)
+                        )
+                    )
+                except TimeoutError:
+                    break
+            try:
+                transcriptions = await loop.run_in_executor(
+                    None, self.decode_batch, [audio for audio, _ in batch]
+                )
+            except Exception as e:
+                logger.error(f"Batched decode of {len(batch)} windows failed: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.batches += 1
+            self.windows += len(batch)
+            for (_, future), transcription in zip(batch, transcriptions):
+                if not future.done():
+                    future.set_result(transcription)
+
 
 def words_from_whisper_segments(segments: Iterable[transcribe.Segment]) -> list[Word]:
     words: list[Word] = []
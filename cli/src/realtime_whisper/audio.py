@@ -1,13 +1,17 @@
 from __future__ import annotations
 
 import multiprocessing
+import queue
+from math import gcd
+from multiprocessing import shared_memory
 from typing import BinaryIO
 
 import numpy as np
 import soundfile as sf
+from numpy.lib.stride_tricks import sliding_window_view
 from numpy.typing import NDArray
 
-from realtime_whisper.config import SAMPLES_PER_SECOND
+from realtime_whisper.config import SAMPLES_PER_SECOND, max_audio_duration
 
 
 def audio_samples_from_file(file: BinaryIO) -> NDArray[np.float32]:
@@ -24,6 +28,126 @@ def audio_samples_from_file(file: BinaryIO) -> NDArray[np.float32]:
     return audio  # type: ignore
 
 
+# same samples as decoding raw PCM_16 with `audio_samples_from_file`,
+# without the round-trip through soundfile. can write into a caller-supplied buffer
+def pcm16_to_float32(
+    pcm: bytes | NDArray[np.int16],
+    out: NDArray[np.float32] | None = None,
+) -> NDArray[np.float32]:
+    if not isinstance(pcm, np.ndarray):
+        pcm = np.frombuffer(pcm, dtype="<i2")
+    if out is None:
+        out = np.empty(len(pcm), dtype=np.float32)
+    np.multiply(pcm, np.float32(1 / 32768), out=out)
+    return out
+
+
+# polyphase resampler that keeps its filter state across frames,
+# so frames can be resampled one by one without artifacts at the frame boundaries.
+# the output matches `scipy.signal.resample_poly` run over the whole signal
+class StreamingResampler:
+    def __init__(
+        self,
+        from_rate: int,
+        to_rate: int = SAMPLES_PER_SECOND,
+    ) -> None:
+        divisor = gcd(from_rate, to_rate)
+        self.up = to_rate // divisor
+        self.down = from_rate // divisor
+
+        # same anti-aliasing filter as `resample_poly`, a kaiser windowed sinc
+        # like `scipy.signal.firwin` makes, without importing scipy.signal
+        max_rate = max(self.up, self.down)
+        half_len = 10 * max_rate
+        h = np.sinc(np.arange(-half_len, half_len + 1) / max_rate) / max_rate
+        h *= np.kaiser(2 * half_len + 1, 5.0)
+        h *= self.up / h.sum()
+
+        # every block of `down` input samples gives exactly `up` output samples,
+        # and the filter phases repeat from one block to the next.
+        # so a block is a single product with a fixed (span, up) matrix of filter taps,
+        # where output i of block q sits at position (q * up + i) * down + half_len
+        # of the upsampled signal
+        positions = np.arange(self.up) * self.down + half_len
+        inputs = [
+            (position - np.arange(position % self.up, len(h), self.up)) // self.up
+            for position in positions
+        ]
+        self.first = int(min(i.min() for i in inputs))
+        self.last = int(max(i.max() for i in inputs))
+        matrix = np.zeros((self.last - self.first + 1, self.up), dtype=np.float32)
+        for i, (position, js) in enumerate(zip(positions, inputs)):
+            matrix[js - self.first, i] = h[position - js * self.up]
+        self.matrix = matrix
+
+        # inputs from `buffer_start` onwards, zeros before the stream starts.
+        # the first `filled` samples of the buffer are in use
+        self.buffer_start = min(self.first, 0)
+        self.buffer = np.zeros(len(self.matrix) + 2 * self.down, dtype=np.float32)
+        self.filled = -self.buffer_start
+        self.next_block = 0
+        self.samples_in = 0
+        self.samples_out = 0
+
+    def __repr__(self) -> str:
+        return f"StreamingResampler(up={self.up}, down={self.down})"
+
+    def process(self, pcm: bytes | NDArray[np.int16]) -> NDArray[np.float32]:
+        """Resample a frame of int16 PCM, returns float32 samples in [-1, 1]"""
+        if not isinstance(pcm, np.ndarray):
+            pcm = np.frombuffer(pcm, dtype=np.int16)
+        pcm16_to_float32(pcm, out=self._reserve(len(pcm)))
+        return self._resample(len(pcm))
+
+    def flush(self) -> NDArray[np.float32]:
+        """Push zeros through the filter to get the samples still held back by its delay"""
+        total_out = -(-self.samples_in * self.up // self.down)
+        remaining = total_out - self.samples_out
+        if remaining <= 0:
+            return np.array([], dtype=np.float32)
+        samples_in = self.samples_in
+        zeros = self.last + self.down
+        self._reserve(zeros)[:] = 0
+        out = self._resample(zeros)[:remaining]
+        self.samples_in = samples_in
+        self.samples_out = total_out
+        return out
+
+    # returns the part of the buffer the next `n` input samples go into
+    def _reserve(self, n: int) -> NDArray[np.float32]:
+        if self.filled + n > len(self.buffer):
+            buffer = np.zeros(2 * (self.filled + n), dtype=np.float32)
+            buffer[: self.filled] = self.buffer[: self.filled]
+            self.buffer = buffer
+        return self.buffer[self.filled : self.filled + n]
+
+    def _resample(self, n: int) -> NDArray[np.float32]:
+        self.filled += n
+        self.samples_in += n
+
+        # a block is ready once the newest input sample it depends on has arrived
+        last_block = (self.samples_in - 1 - self.last) // self.down
+        blocks = last_block + 1 - self.next_block
+        if blocks <= 0:
+            return np.array([], dtype=np.float32)
+
+        span = len(self.matrix)
+        start = self.next_block * self.down + self.first - self.buffer_start
+        buffer = self.buffer[start : self.filled]
+        windows = sliding_window_view(buffer, span)[:: self.down][:blocks]
+        out = (windows @ self.matrix).ravel()
+
+        # move the inputs still needed by the next block to the front
+        self.next_block += blocks
+        self.samples_out += len(out)
+        buffer_start = self.next_block * self.down + self.first
+        consumed = buffer_start - self.buffer_start
+        self.filled -= consumed
+        self.buffer[: self.filled] = self.buffer[consumed : consumed + self.filled]
+        self.buffer_start = buffer_start
+        return out
+
+
 class Audio:
     def __init__(
         self,
@@ -45,23 +169,238 @@ class Audio:
         return len(self.data) / SAMPLES_PER_SECOND
 
     def after(self, ts: float) -> Audio:
-        assert ts <= self.duration
-        return Audio(self.data[int(ts * SAMPLES_PER_SECOND) :], start=ts)
+        assert ts <= self.end
+        ts = max(ts, self.start)
+        return Audio(
+            self.data[int((ts - self.start) * SAMPLES_PER_SECOND) :],
+            start=ts,
+        )
+
+
+# fixed-capacity float32 ring buffer.
+# the storage is twice the capacity and the live samples are moved back to the front
+# once they reach the end, so they are always contiguous and can be handed out as views.
+# each sample is copied at most once more per `capacity` appended samples, so appends
+# are amortized O(1)
+class RingBuffer:
+    def __init__(self, capacity: int) -> None:
+        assert capacity > 0
+        self.capacity = capacity
+        self._data = np.zeros(2 * capacity, dtype=np.float32)
+        self._head = 0
+        self._tail = 0
+        # total number of samples dropped from the front since creation
+        self.dropped = 0
+
+    def __len__(self) -> int:
+        return self._tail - self._head
+
+    def __repr__(self) -> str:
+        return f"RingBuffer(len={len(self)}, capacity={self.capacity})"
+
+    def view(self) -> NDArray[np.float32]:
+        """Zero-copy view of the live samples, valid until the next `extend`"""
+        return self._data[self._head : self._tail]
 
     def extend(self, data: NDArray[np.float32]) -> None:
-        self.data = np.append(self.data, data)
+        """Append samples, dropping the oldest ones when the buffer is full"""
+        if len(data) > self.capacity:
+            self.drop(len(self))
+            self.dropped += len(data) - self.capacity
+            data = data[-self.capacity :]
+        overflow = len(self) + len(data) - self.capacity
+        if overflow > 0:
+            self.drop(overflow)
+        if self._tail + len(data) > len(self._data):
+            size = len(self)
+            self._data[:size] = self._data[self._head : self._tail]
+            self._head, self._tail = 0, size
+        self._data[self._tail : self._tail + len(data)] = data
+        self._tail += len(data)
+
+    def drop(self, n: int) -> None:
+        """Drop the `n` oldest samples"""
+        n = min(n, len(self))
+        self._head += n
+        self.dropped += n
+        if self._head == self._tail:
+            self._head = self._tail = 0
+
 
+# growing audio, e.g. everything recorded since the last confirmed sentence.
+# it keeps at most `max_duration` seconds, older audio is dropped
+class AudioBuffer:
+    def __init__(
+        self,
+        max_duration: float = max_audio_duration,
+        start: float = 0.0,
+    ) -> None:
+        self.ring = RingBuffer(int(max_duration * SAMPLES_PER_SECOND))
+        self.origin = start
 
+    def __repr__(self) -> str:
+        return f"AudioBuffer(start={self.start:.2f}, end={self.end:.2f})"
+
+    @property
+    def data(self) -> NDArray[np.float32]:
+        return self.ring.view()
+
+    @property
+    def start(self) -> float:
+        return self.origin + self.ring.dropped / SAMPLES_PER_SECOND
+
+    @property
+    def end(self) -> float:
+        return self.start + self.duration
+
+    @property
+    def duration(self) -> float:
+        return len(self.ring) / SAMPLES_PER_SECOND
+
+    def after(self, ts: float) -> Audio:
+        """Zero-copy view of the audio after `ts`, valid until the next `extend`"""
+        return Audio(self.data, start=self.start).after(ts)
+
+    def extend(self, data: NDArray[np.float32]) -> None:
+        self.ring.extend(data)
+
+    def trim(self, ts: float) -> None:
+        """Drop the audio before `ts`, it will not be transcribed again"""
+        if ts > self.start:
+            self.ring.drop(int((ts - self.start) * SAMPLES_PER_SECOND))
+
+
+# audio chunks sent from the recorder to the transcription worker.
+# this backend goes through a `multiprocessing.Queue`, so every chunk is pickled
 class AudioStream:
     def __init__(self, data_queue: multiprocessing.Queue):
         self.data_queue = data_queue
         self.closed = False
 
-    def extend(self, data: NDArray[np.float32], timestamp: float) -> None:
+    def extend(
+        self, data: NDArray[np.float32], timestamp: float, speech: float = 1.0
+    ) -> None:
+        """`speech` is the fraction of the chunk tagged as speech"""
         assert not self.closed
-        self.data_queue.put((timestamp, data))
+        self.data_queue.put((timestamp, data, speech))
+
+    def get(
+        self, timeout: float = 0.0
+    ) -> tuple[float, NDArray[np.float32], float] | None:
+        """Next (timestamp, chunk, speech), or None if no chunk arrives within `timeout`"""
+        try:
+            item = self.data_queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if item is None:
+            self.closed = True
+        return item
 
     def close(self) -> None:
         assert not self.closed
         self.closed = True
         self.data_queue.put(None)
+
+    def unlink(self) -> None:
+        pass
+
+
+# single-producer/single-consumer audio stream in shared memory, so chunks
+# are not pickled. the recorder writes each chunk into the next of `slots` fixed-size
+# slots and then moves the write cursor, the transcription worker gets numpy views
+# of the slots. a view stays valid until the recorder wraps around to its slot again
+class SharedMemoryAudioStream:
+    def __init__(
+        self,
+        slots: int = 32,
+        slot_size: int = SAMPLES_PER_SECOND,
+    ) -> None:
+        self.slots = slots
+        self.slot_size = slot_size
+        size = 8 * 2 + slots * (8 + 8 + 8 + 4 * slot_size)
+        self.shm = shared_memory.SharedMemory(create=True, size=size)
+        # counts the chunks written, so the consumer can block until one arrives
+        self.available = multiprocessing.Semaphore(0)
+        # chunks read by the consumer, local to the consumer process
+        self.read_cursor = 0
+        # chunks the consumer lost because it fell `slots` chunks behind
+        self.overruns = 0
+        self._attach()
+        self.header[:] = 0
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        for view in ["header", "lengths", "timestamps", "speech", "samples"]:
+            del state[view]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._attach()
+
+    def _attach(self) -> None:
+        buf = self.shm.buf
+        # header is [write cursor, closed]
+        self.header = np.ndarray((2,), dtype=np.int64, buffer=buf)
+        offset = self.header.nbytes
+        self.lengths = np.ndarray((self.slots,), np.int64, buf, offset)
+        offset += self.lengths.nbytes
+        self.timestamps = np.ndarray((self.slots,), np.float64, buf, offset)
+        offset += self.timestamps.nbytes
+        self.speech = np.ndarray((self.slots,), np.float64, buf, offset)
+        offset += self.speech.nbytes
+        self.samples = np.ndarray((self.slots, self.slot_size), np.float32, buf, offset)
+
+    @property
+    def closed(self) -> bool:
+        return bool(self.header[1])
+
+    def extend(
+        self, data: NDArray[np.float32], timestamp: float, speech: float = 1.0
+    ) -> None:
+        """`speech` is the fraction of the chunk tagged as speech"""
+        assert not self.closed
+        for start in range(0, len(data), self.slot_size):
+            part = data[start : start + self.slot_size]
+            cursor = int(self.header[0])
+            slot = cursor % self.slots
+            self.samples[slot, : len(part)] = part
+            self.lengths[slot] = len(part)
+            self.timestamps[slot] = timestamp
+            self.speech[slot] = speech
+            # publish the chunk only once it is fully written
+            self.header[0] = cursor + 1
+            self.available.release()
+
+    def get(
+        self, timeout: float = 0.0
+    ) -> tuple[float, NDArray[np.float32], float] | None:
+        """Next (timestamp, chunk, speech) with the chunk as a view,
+        or None if no chunk arrives within `timeout`"""
+        if not self.available.acquire(timeout=timeout):
+            return None
+        write_cursor = int(self.header[0])
+        if write_cursor - self.read_cursor > self.slots:
+            self.overruns += write_cursor - self.slots - self.read_cursor
+            self.read_cursor = write_cursor - self.slots
+        if self.read_cursor >= write_cursor:
+            return None
+        slot = self.read_cursor % self.slots
+        self.read_cursor += 1
+        length = int(self.lengths[slot])
+        return (
+            float(self.timestamps[slot]),
+            self.samples[slot, :length],
+            float(self.speech[slot]),
+        )
+
+    def close(self) -> None:
+        assert not self.closed
+        self.header[1] = 1
+        self.available.release()
+
+    def unlink(self) -> None:
+        """Free the shared memory, called once by the process that created the stream"""
+        del self.header, self.lengths, self.timestamps, self.speech, self.samples
+        self.shm.close()
+        self.shm.unlink()
@@ -1,3 +1,13 @@
 SAMPLES_PER_SECOND = 16000
 word_timestamp_error_margin = 0.2
 min_duration = 1.0
+max_audio_duration = 60.0
+# whisper sees at most 30 seconds at a time, the decoded window stays below that
+max_window_duration = 20.0
+# without a full stop, the confirmed words are committed after this long or this many words
+force_commit_duration = 10.0
+force_commit_words = 30
+# a decode is skipped until this much new audio arrived,
+# or this fraction of the window when the window is long
+min_new_audio = 1.0
+new_audio_ratio = 0.1
@@ -1,8 +1,9 @@
 # TODO: rename module
 from __future__ import annotations
 
+import json
 import re
-from dataclasses import dataclass
+from dataclasses import asdict, dataclass
 
 from realtime_whisper.config import word_timestamp_error_margin
 
@@ -45,15 +46,55 @@ class Word(Segment):
         return a[:i]
 
 
+# append-only log of the words that were dropped from a windowed `Transcription`
+class TranscriptArchive:
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def append(self, words: list[Word]) -> None:
+        with open(self.path, "a") as file:
+            for word in words:
+                file.write(json.dumps(asdict(word)) + "\n")
+
+    def read(self) -> list[Word]:
+        with open(self.path) as file:
+            return [Word(**json.loads(line)) for line in file]
+
+
 class Transcription:
-    def __init__(self, words: list[Word] = []) -> None:
+    def __init__(
+        self,
+        words: list[Word] = [],
+        max_words: int | None = None,
+        archive: TranscriptArchive | None = None,
+    ) -> None:
         self.words: list[Word] = []
+        # with `max_words`, only the live tail of the words is kept in memory,
+        # older words are moved to the archive.
+        # `offset` is the number of words dropped, so the word at `self.words[i]`
+        # always has the index `offset + i`
+        self.max_words = max_words
+        self.archive = archive
+        self.offset = 0
+        # the last full sentence, kept up to date as words are added
+        # so it doesn't have to be recomputed from all the words
+        self.last_sentence: Segment | None = None
+        # index of the first word after the last full sentence
+        self.sentence_start = 0
         self.extend(words)
 
+    def __len__(self) -> int:
+        """Number of words, including the archived ones"""
+        return self.offset + len(self.words)
+
     @property
     def text(self) -> str:
         return " ".join(word.text for word in self.words).strip()
 
+    def text_after(self, index: int) -> str:
+        """Text of the words from `index` on, as far as they are still in memory"""
+        return to_text(self.words[max(index - self.offset, 0) :]).strip()
+
     @property
     def start(self) -> float:
         return self.words[0].start if len(self.words) > 0 else 0.0
@@ -73,7 +114,26 @@ class Transcription:
 
     def extend(self, words: list[Word]) -> None:
         self._ensure_no_word_overlap(words)
+        start = len(self)
         self.words.extend(words)
+        for i in range(start, len(self)):
+            if self.words[i - self.offset].is_eos:
+                # a sentence longer than the window only keeps its words in memory
+                first = max(self.sentence_start - self.offset, 0)
+                sentence = self.words[first : i - self.offset + 1]
+                self.last_sentence = Segment(
+                    text=to_text(sentence),
+                    start=sentence[0].start,
+                    end=sentence[-1].end,
+                )
+                self.sentence_start = i + 1
+        # archive in batches of a quarter window, so words aren't shifted every time
+        if self.max_words is not None and len(self.words) > self.max_words * 5 // 4:
+            dropped = len(self.words) - self.max_words
+            if self.archive is not None:
+                self.archive.append(self.words[:dropped])
+            del self.words[:dropped]
+            self.offset += dropped
 
     def _ensure_no_word_overlap(self, words: list[Word]) -> None:
         if len(self.words) > 0 and len(words) > 0:
@@ -88,17 +148,6 @@ class Transcription:
                 )
 
 
-def test_segment_is_eos():
-    assert not Segment("Hello").is_eos
-    assert not Segment("Hello...").is_eos
-    assert Segment("Hello.").is_eos
-    assert Segment("Hello!").is_eos
-    assert Segment("Hello?").is_eos
-    assert not Segment("Hello. Yo").is_eos
-    assert not Segment("Hello. Yo...").is_eos
-    assert Segment("Hello. Yo.").is_eos
-
-
 def to_full_sentences(words: list[Word]) -> list[Segment]:
     sentences: list[Segment] = [Segment("")]
     for word in words:
@@ -114,18 +163,6 @@ def to_full_sentences(words: list[Word]) -> list[Segment]:
     return sentences
 
 
-def tests_to_full_sentences():
-    assert to_full_sentences([]) == []
-    assert to_full_sentences([Word(text="Hello")]) == []
-    assert to_full_sentences([Word(text="Hello..."), Word(" world")]) == []
-    assert to_full_sentences([Word(text="Hello..."), Word(" world.")]) == [
-        Segment(text="Hello... world.")
-    ]
-    assert to_full_sentences(
-        [Word(text="Hello..."), Word(" world."), Word(" How")]
-    ) == [Segment(text="Hello... world.")]
-
-
 def to_text(words: list[Word]) -> str:
     return "".join(word.text for word in words)
 
@@ -141,12 +178,6 @@ def canonicalize_word(text: str) -> str:
     return text.lower().strip().strip(".,?!")
 
 
-def test_canonicalize_word():
-    assert canonicalize_word("ABC") == "abc"
-    assert canonicalize_word("...ABC?") == "abc"
-    assert canonicalize_word("... AbC  ...") == "abc"
-
-
 def common_prefix(a: list[Word], b: list[Word]) -> list[Word]:
     i = 0
     while (
@@ -156,49 +187,3 @@ def common_prefix(a: list[Word], b: list[Word]) -> list[Word]:
     ):
         i += 1
     return a[:i]
-
-
-def test_common_prefix():
-    def word(text: str) -> Word:
-        return Word(text=text, start=0.0, end=0.0, probability=0.0)
-
-    a = [word("a"), word("b"), word("c")]
-    b = [word("a"), word("b"), word("c")]
-    assert common_prefix(a, b) == [word("a"), word("b"), word("c")]
-
-    a = [word("a"), word("b"), word("c")]
-    b = [word("a"), word("b"), word("d")]
-    assert common_prefix(a, b) == [word("a"), word("b")]
-
-    a = [word("a"), word("b"), word("c")]
-    b = [word("a")]
-    assert common_prefix(a, b) == [word("a")]
-
-    a = [word("a")]
-    b = [word("a"), word("b"), word("c")]
-    assert common_prefix(a, b) == [word("a")]
-
-    a = [word("a")]
-    b = []
-    assert common_prefix(a, b) == []
-
-    a = []
-    b = [word("a")]
-    assert common_prefix(a, b) == []
-
-    a = [word("a"), word("b"), word("c")]
-    b = [word("b"), word("c")]
-    assert common_prefix(a, b) == []
-
-
-def test_common_prefix_and_canonicalization():
-    def word(text: str) -> Word:
-        return Word(text=text, start=0.0, end=0.0, probability=0.0)
-
-    a = [word("A...")]
-    b = [word("a?"), word("b"), word("c")]
-    assert common_prefix(a, b) == [word("A...")]
-
-    a = [word("A..."), word("B?"), word("C,")]
-    b = [word("a??"), word("  b"), word(" ,c")]
-    assert common_prefix(a, b) == [word("A..."), word("B?"), word("C,")]
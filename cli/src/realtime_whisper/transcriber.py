@@ -1,17 +1,26 @@
 from __future__ import annotations
 
-from typing import AsyncGenerator
+from typing import TYPE_CHECKING, AsyncGenerator
 
-from realtime_whisper.asr import FasterWhisperASR
-from realtime_whisper.audio import Audio, AudioStream
-from realtime_whisper.config import min_duration
+from realtime_whisper.audio import AudioBuffer, AudioStream
+from realtime_whisper.config import (
+    force_commit_duration,
+    force_commit_words,
+    max_window_duration,
+    min_duration,
+    min_new_audio,
+    new_audio_ratio,
+)
 from realtime_whisper.core import (
     Transcription,
     Word,
     common_prefix,
-    to_full_sentences,
+    to_text,
 )
 
+if TYPE_CHECKING:
+    from realtime_whisper.asr import ASRBackend
+
 
 class LocalAgreement:
     def __init__(self) -> None:
@@ -31,44 +40,118 @@ class LocalAgreement:
 
     @classmethod
     def prompt(cls, confirmed: Transcription) -> str | None:
-        sentences = to_full_sentences(confirmed.words)
-        if len(sentences) == 0:
-            return None
-        return sentences[-1].text
+        return prompt(confirmed)
 
     # TODO: better name
     @classmethod
     def needs_audio_after(cls, confirmed: Transcription) -> float:
-        full_sentences = to_full_sentences(confirmed.words)
-        return full_sentences[-1].end if len(full_sentences) > 0 else 0.0
+        return needs_audio_after(confirmed)
 
 
 def needs_audio_after(confirmed: Transcription) -> float:
-    full_sentences = to_full_sentences(confirmed.words)
-    return full_sentences[-1].end if len(full_sentences) > 0 else 0.0
+    sentence = confirmed.last_sentence
+    return sentence.end if sentence is not None else 0.0
 
 
 def prompt(confirmed: Transcription) -> str | None:
-    sentences = to_full_sentences(confirmed.words)
-    if len(sentences) == 0:
-        return None
-    return sentences[-1].text
+    sentence = confirmed.last_sentence
+    return sentence.text if sentence is not None else None
+
+
+# picks the audio every decode looks at. by default that is everything after the
+# last full sentence, but every decode re-reads the whole window, so a long sentence
+# makes each update slower until whisper's 30 seconds run out. here the confirmed
+# words are committed early once the window gets too long or has too many words,
+# the window is capped, and decodes are skipped until enough new audio arrived
+class AdaptiveWindow:
+    def __init__(
+        self,
+        max_duration: float = max_window_duration,
+        commit_duration: float = force_commit_duration,
+        commit_words: int = force_commit_words,
+        min_new_audio: float = min_new_audio,
+        new_audio_ratio: float = new_audio_ratio,
+    ) -> None:
+        self.max_duration = max_duration
+        self.commit_duration = commit_duration
+        self.commit_words = commit_words
+        self.min_new_audio = min_new_audio
+        self.new_audio_ratio = new_audio_ratio
+        # time and index of the first word after the last forced commit
+        self.committed = 0.0
+        self.committed_index = 0
+        # end of the audio the last decode looked at
+        self.decoded_until = 0.0
+        self.forced_commits = 0
+        self.capped = 0
+
+    def start(self, confirmed: Transcription) -> float:
+        """Start of the audio that still needs to be decoded"""
+        return max(needs_audio_after(confirmed), self.committed)
+
+    def prompt(self, confirmed: Transcription) -> str | None:
+        """The last sentence, plus the words committed since"""
+        if self.committed_index <= confirmed.sentence_start:
+            return prompt(confirmed)
+        first = max(
+            confirmed.sentence_start,
+            self.committed_index - self.commit_words,
+            confirmed.offset,
+        )
+        words = confirmed.words[
+            first - confirmed.offset : self.committed_index - confirmed.offset
+        ]
+        return to_text(words).strip()
+
+    def should_decode(self, start: float, end: float, force: bool = False) -> bool:
+        """Whether the audio up to `end` has enough new audio to be worth a decode"""
+        required = max(self.min_new_audio, (end - start) * self.new_audio_ratio)
+        if force or end - self.decoded_until >= required:
+            self.decoded_until = end
+            return True
+        return False
+
+    def commit(self, confirmed: Transcription, end: float) -> float:
+        """Moves the start of the window forward if it got too long, returns the start"""
+        start = self.start(confirmed)
+        first = max(confirmed.sentence_start, self.committed_index)
+        if confirmed.end > start and (
+            end - start > self.commit_duration
+            or len(confirmed) - first >= self.commit_words
+        ):
+            self.committed = confirmed.end
+            self.committed_index = len(confirmed)
+            self.forced_commits += 1
+            start = self.committed
+        # nothing was confirmed for a long time, the oldest audio is given up on
+        if end - start > self.max_duration:
+            self.committed = end - self.max_duration
+            self.committed_index = len(confirmed)
+            self.capped += 1
+            start = self.committed
+        return start
 
 
 async def audio_transcriber(
-    asr: FasterWhisperASR,
+    asr: ASRBackend,
     audio_stream: AudioStream,
 ) -> AsyncGenerator[Transcription, None]:
     local_agreement = LocalAgreement()
-    full_audio = Audio()
+    window = AdaptiveWindow()
+    full_audio = AudioBuffer()
     confirmed = Transcription()
     async for timestamp, chunk in audio_stream.chunks(min_duration):
         full_audio.extend(chunk)
-        audio = full_audio.after(needs_audio_after(confirmed))
-        transcription, _ = await asr.transcribe(audio, prompt(confirmed))
+        start = window.commit(confirmed, full_audio.end)
+        full_audio.trim(start)
+        if not window.should_decode(start, full_audio.end):
+            continue
+        audio = full_audio.after(start)
+        transcription, _ = await asr.transcribe(audio, window.prompt(confirmed))
         new_words = local_agreement.merge(confirmed, transcription)
         if len(new_words) > 0:
             confirmed.extend(new_words)
+            full_audio.trim(window.start(confirmed))
             yield timestamp, confirmed
     confirmed.extend(local_agreement.unconfirmed.words)
     yield timestamp, confirmed
@@ -0,0 +1,37 @@
+from __future__ import annotations
+
+import numpy as np
+import webrtcvad
+from numpy.typing import NDArray
+
+from realtime_whisper.config import SAMPLES_PER_SECOND
+
+
+# tags every frame of the recorded audio as speech or non-speech with webrtcvad,
+# so chunks can carry how much of them is speech
+class SpeechTagger:
+    def __init__(self, mode: int = 1, frame_duration_ms: int = 30) -> None:
+        self.vad = webrtcvad.Vad(mode)
+        self.frame_size = SAMPLES_PER_SECOND * frame_duration_ms // 1000
+        # samples that don't fill a frame yet
+        self.pending = np.array([], dtype=np.int16)
+        # frames tagged since the last `take`
+        self.frames = 0
+        self.speech_frames = 0
+
+    def process(self, audio: NDArray[np.float32]) -> None:
+        pcm = (np.clip(audio, -1, 1) * 32767).astype(np.int16)
+        pcm = np.concatenate((self.pending, pcm))
+        end = len(pcm) - len(pcm) % self.frame_size
+        for start in range(0, end, self.frame_size):
+            frame = pcm[start : start + self.frame_size].tobytes()
+            self.frames += 1
+            self.speech_frames += self.vad.is_speech(frame, SAMPLES_PER_SECOND)
+        self.pending = pcm[end:]
+
+    def take(self) -> float:
+        """Fraction of speech frames since the last call"""
+        speech = self.speech_frames / self.frames if self.frames > 0 else 0.0
+        self.frames = 0
+        self.speech_frames = 0
+        return speech
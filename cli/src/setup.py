@@ -1,5 +1,5 @@
 import os
-from typing import Tuple
+from typing import Callable, Tuple
 import requests
 
 from pyaudio import PyAudio, Stream, paInt16
@@ -25,7 +25,8 @@ def _list_audio_devices(p: PyAudio):
 
 
 # function to get a stream and pyaudio instance
-def _get_stream() -> Tuple[Stream, PyAudio]:
+# with a callback, the stream runs in callback mode instead of blocking reads
+def _get_stream(stream_callback: Callable | None = None) -> Tuple[Stream, PyAudio]:
     input_device_index = int(os.getenv("SOUND_INPUT_DEVICE"))
 
     # this is a stream that we only use for setup
@@ -39,6 +40,7 @@ def _get_stream() -> Tuple[Stream, PyAudio]:
         input=True,
         frames_per_buffer=constants.CORRECT_FRAME_LENGTH,
         input_device_index=input_device_index,
+        stream_callback=stream_callback,
     )
     return stream, p
 
@@ -66,12 +68,14 @@ def check_api_health() -> None:
 
 
 # checks sample rate, frame length
-def check_recording_params() -> Tuple[Stream, PyAudio]:
+def check_recording_params(
+    stream_callback: Callable | None = None,
+) -> Tuple[Stream, PyAudio]:
     p = None
     stream = None
 
     try:
-        stream, p = _get_stream()
+        stream, p = _get_stream(stream_callback)
 
         _log_devices(p)
 
@@ -0,0 +1,52 @@
+import multiprocessing
+import queue
+import time
+from contextlib import contextmanager
+
+
+# timings of the startup phases, which run concurrently in all the processes.
+# every process reports its phases through a queue, and the main process
+# waits for them and prints the report
+class StartupProfile:
+    def __init__(self, origin: float | None = None) -> None:
+        # wall clock time, so the timings of all processes line up
+        self.origin = time.time() if origin is None else origin
+        self.queue: multiprocessing.Queue = multiprocessing.Queue()
+        self.phases: dict[str, tuple[float, float]] = {}
+
+    def record(self, name: str, start: float, end: float) -> None:
+        """Report a phase that ran from `start` to `end` (wall clock)"""
+        self.queue.put((name, start - self.origin, end - self.origin))
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.time())
+
+    def wait(self, names: list[str], timeout: float = 120.0) -> bool:
+        """Collect the reported phases until all of `names` are in, or the timeout"""
+        deadline = time.monotonic() + timeout
+        while not all(name in self.phases for name in names):
+            try:
+                name, start, end = self.queue.get(
+                    timeout=max(deadline - time.monotonic(), 0.001)
+                )
+            except queue.Empty:
+                return False
+            self.phases[name] = (start, end)
+        return True
+
+    @property
+    def ready(self) -> float:
+        """Seconds from the start until the last phase ended"""
+        return max((end for _, end in self.phases.values()), default=0.0)
+
+    def report(self) -> str:
+        lines = [f"{'phase':<16} {'start s':>8} {'end s':>8} {'took s':>8}"]
+        for name, (start, end) in sorted(self.phases.items(), key=lambda p: p[1]):
+            lines.append(f"{name:<16} {start:>8.2f} {end:>8.2f} {end - start:>8.2f}")
+        lines.append(f"{'ready':<16} {'':>8} {self.ready:>8.2f}")
+        return "\n".join(lines)
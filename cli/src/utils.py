@@ -1,8 +1,6 @@
 import asyncio
 import os
 import re
-from typing import Tuple
-from pyaudio import PyAudio, paInt16, Stream
 import constants
 from custom_logger import logger
 
@@ -0,0 +1,91 @@
+import os
+from typing import Protocol
+
+import numpy as np
+from numpy.typing import NDArray
+
+import constants
+from custom_logger import logger
+
+
+# a wake word detector is fed every 16 kHz float32 chunk the recorder sends,
+# and returns True when the wake word was said in it
+class WakeWordDetector(Protocol):
+    def process(self, audio: NDArray[np.float32]) -> bool: ...
+
+
+# picovoice porcupine, needs an access key and a keyword file trained for "peach"
+class PorcupineDetector:
+    def __init__(
+        self,
+        access_key: str,
+        keyword_path: str,
+        sensitivity: float = 0.5,
+    ) -> None:
+        import pvporcupine
+
+        self.porcupine = pvporcupine.create(
+            access_key=access_key,
+            keyword_paths=[keyword_path],
+            sensitivities=[sensitivity],
+        )
+        # samples left over from the last chunk, porcupine takes fixed-size frames
+        self.pending = np.array([], dtype=np.int16)
+
+    def process(self, audio: NDArray[np.float32]) -> bool:
+        pcm = (np.clip(audio, -1, 1) * 32767).astype(np.int16)
+        pcm = np.concatenate((self.pending, pcm))
+        frame_length = self.porcupine.frame_length
+        detected = False
+        end = len(pcm) - len(pcm) % frame_length
+        for start in range(0, end, frame_length):
+            if self.porcupine.process(pcm[start : start + frame_length]) >= 0:
+                detected = True
+        self.pending = pcm[end:]
+        return detected
+
+
+# chooses the detector from the env, None means there is no wake word stage.
+# porcupine is the only detector, it can't be the default: it needs an access key
+# and a keyword file trained for "peach", and neither can ship with the repo.
+# without them whisper runs on all speech, as it did before there was a gate
+def create_wake_word_detector() -> WakeWordDetector | None:
+    access_key = os.getenv("PORCUPINE_ACCESS_KEY")
+    keyword_path = os.getenv("PORCUPINE_KEYWORD_PATH")
+    if access_key and keyword_path:
+        logger.info("Using porcupine wake word detector")
+        return PorcupineDetector(access_key, keyword_path)
+    logger.warning(
+        "No wake word detector, set PORCUPINE_ACCESS_KEY and PORCUPINE_KEYWORD_PATH"
+        " to only run whisper after the wake word"
+    )
+    return None
+
+
+# gates the transcription, the asr only runs after the wake word
+# and for WAKE_WORD_HOLD seconds after the last words were transcribed
+class WakeWordGate:
+    def __init__(
+        self,
+        detector: WakeWordDetector | None,
+        hold: float = constants.WAKE_WORD_HOLD,
+    ) -> None:
+        self.detector = detector
+        self.hold = hold
+        self.open_until = 0.0
+
+    def process(self, audio: NDArray[np.float32], timestamp: float) -> bool:
+        """True if the asr should run on this chunk"""
+        if self.is_open(timestamp):
+            return True
+        if self.detector.process(audio):
+            logger.info("🍑 Wake word detected, starting transcription")
+            self.keep_open(timestamp)
+            return True
+        return False
+
+    def is_open(self, timestamp: float) -> bool:
+        return self.detector is None or timestamp <= self.open_until
+
+    def keep_open(self, timestamp: float) -> None:
+        self.open_until = max(self.open_until, timestamp + self.hold)
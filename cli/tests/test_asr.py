@@ -0,0 +1,37 @@
+import asyncio
+import time
+
+import numpy as np
+
+from realtime_whisper.asr import BatchedASREngine
+from realtime_whisper.audio import Audio
+from realtime_whisper.config import SAMPLES_PER_SECOND
+from realtime_whisper.core import Transcription, Word
+
+
+def test_batched_asr_engine():
+    calls = []
+
+    # every word starts where its window starts
+    def decode_batch(audios: list[Audio]) -> list[Transcription]:
+        calls.append(len(audios))
+        time.sleep(0.01)
+        return [
+            Transcription([Word(f" w{audio.start:.0f}", audio.start, audio.end)])
+            for audio in audios
+        ]
+
+    async def main():
+        engine = BatchedASREngine(decode_batch, max_batch_size=4)
+        runner = asyncio.create_task(engine.run())
+        audio = np.zeros(SAMPLES_PER_SECOND, dtype=np.float32)
+        results = await asyncio.gather(
+            *(engine.transcribe(Audio(audio, start=i)) for i in range(6))
+        )
+        runner.cancel()
+        return engine, results
+
+    engine, results = asyncio.run(main())
+    assert [t.text for t, _ in results] == [f"w{i}" for i in range(6)]
+    assert calls == [4, 2]
+    assert (engine.batches, engine.windows) == (2, 6)
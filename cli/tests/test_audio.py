@@ -0,0 +1,123 @@
+import numpy as np
+
+from realtime_whisper.audio import (
+    AudioBuffer,
+    RingBuffer,
+    SharedMemoryAudioStream,
+    StreamingResampler,
+    audio_samples_from_file,
+    pcm16_to_float32,
+)
+from realtime_whisper.config import SAMPLES_PER_SECOND
+
+
+def test_streaming_resampler_matches_offline():
+    from scipy.signal import resample_poly
+
+    rng = np.random.default_rng(0)
+    seconds = np.arange(44100) / 44100
+    signal = 8000 * np.sin(2 * np.pi * 440 * seconds) + rng.normal(0, 500, 44100)
+    pcm = signal.astype(np.int16)
+
+    resampler = StreamingResampler(44100, 16000)
+    frames = [resampler.process(pcm[i : i + 480]) for i in range(0, len(pcm), 480)]
+    streamed = np.concatenate([*frames, resampler.flush()])
+
+    offline = resample_poly(pcm.astype(np.float64) / 32768.0, 160, 441)
+    assert len(streamed) == len(offline)
+    assert np.allclose(streamed, offline, atol=1e-5)
+
+
+def test_streaming_resampler_odd_frame_sizes():
+    pcm = (np.arange(5000) % 200 - 100).astype(np.int16) * 100
+    offline = StreamingResampler(44100, 16000)
+    expected = np.concatenate([offline.process(pcm), offline.flush()])
+
+    resampler = StreamingResampler(44100, 16000)
+    frames, i = [], 0
+    for size in [1, 7, 480, 3, 1000, 512] * 10:
+        frames.append(resampler.process(pcm[i : i + size]))
+        i += size
+    streamed = np.concatenate([*frames, resampler.flush()])
+    assert np.allclose(streamed, expected, atol=1e-6)
+
+
+def test_ring_buffer():
+    ring = RingBuffer(4)
+    ring.extend(np.array([1, 2, 3], dtype=np.float32))
+    assert ring.view().tolist() == [1, 2, 3]
+    ring.extend(np.array([4, 5], dtype=np.float32))
+    assert ring.view().tolist() == [2, 3, 4, 5]
+    assert ring.dropped == 1
+    ring.drop(3)
+    assert ring.view().tolist() == [5]
+    ring.extend(np.arange(6, 12, dtype=np.float32))
+    assert ring.view().tolist() == [8, 9, 10, 11]
+    assert ring.dropped == 7
+
+
+def test_ring_buffer_storage_stays_fixed():
+    ring = RingBuffer(1000)
+    storage = ring._data
+    expected = np.arange(100_000, dtype=np.float32)
+    for i in range(37, len(expected), 37):
+        ring.extend(expected[i - 37 : i])
+        assert np.array_equal(ring.view(), expected[max(0, i - 1000) : i])
+    assert ring._data is storage
+
+
+def test_audio_buffer():
+    audio = AudioBuffer(max_duration=2.0)
+    audio.extend(np.ones(SAMPLES_PER_SECOND, dtype=np.float32))
+    audio.extend(np.zeros(SAMPLES_PER_SECOND, dtype=np.float32))
+    assert audio.after(0.5).start == 0.5
+    assert audio.after(0.5).duration == 1.5
+
+    audio.trim(1.0)
+    assert audio.start == 1.0
+    assert not audio.data.any()
+    # trimming to before the start keeps the audio
+    audio.trim(0.5)
+    assert audio.start == 1.0
+    assert audio.after(0.5).start == 1.0
+
+    audio.extend(np.ones(2 * SAMPLES_PER_SECOND, dtype=np.float32))
+    assert (audio.start, audio.end) == (2.0, 4.0)
+    assert audio.after(3.0).duration == 1.0
+
+
+def test_pcm16_to_float32_matches_soundfile():
+    from io import BytesIO
+
+    pcm = np.array([-32768, -1, 0, 1, 12345, 32767], dtype=np.int16)
+    expected = audio_samples_from_file(BytesIO(pcm.tobytes()))
+    assert np.array_equal(pcm16_to_float32(pcm.tobytes()), expected)
+
+    out = np.full(8, 7, dtype=np.float32)
+    pcm16_to_float32(pcm, out=out[1:7])
+    assert np.array_equal(out[1:7], expected)
+    assert out[0] == out[7] == 7
+
+
+def test_shared_memory_audio_stream():
+    stream = SharedMemoryAudioStream(slots=4, slot_size=10)
+    try:
+        assert stream.get() is None
+
+        stream.extend(np.arange(15, dtype=np.float32), 1.0, speech=0.5)
+        timestamp, chunk, speech = stream.get()
+        assert (timestamp, speech) == (1.0, 0.5)
+        assert chunk.tolist() == list(range(10))
+        assert stream.get()[1].tolist() == list(range(10, 15))
+        assert stream.get() is None
+
+        for i in range(6):
+            stream.extend(np.full(3, i, dtype=np.float32), float(i))
+        timestamp, chunk, speech = stream.get()
+        assert (timestamp, chunk.tolist(), speech) == (2.0, [2, 2, 2], 1.0)
+        assert stream.overruns == 2
+
+        stream.close()
+        assert stream.closed
+    finally:
+        stream.unlink()
@@ -0,0 +1,41 @@
+import asyncio
+
+import numpy as np
+import soundfile as sf
+
+import constants
+from capture import AudioCapture, FileCapture
+
+
+def test_file_capture(tmp_path):
+    path = tmp_path / "fixture.wav"
+    pcm = np.arange(10_000, dtype=np.int16)
+    sf.write(path, pcm, constants.MIC_SAMPLE_RATE, subtype="PCM_16")
+
+    async def run():
+        capture = FileCapture(str(path), realtime=False)
+        capture.start()
+        frames = []
+        while len(frames) < len(pcm) // constants.SAMPLES_PER_FRAME:
+            frames.append(await asyncio.wait_for(capture.read(), timeout=1))
+        capture.close()
+        return capture, frames
+
+    capture, frames = asyncio.run(run())
+    assert all(len(frame) == constants.FRAME_SIZE_BYTES for frame in frames)
+    received = np.frombuffer(b"".join(frames), dtype=np.int16)
+    assert np.array_equal(received, pcm[: len(received)])
+    assert capture.dropped == 0
+
+
+def test_capture_drops_oldest_frames_when_reader_falls_behind():
+    async def run():
+        capture = AudioCapture(max_frames=2)
+        capture.start()
+        for i in range(5):
+            capture._on_audio(bytes([i]) * constants.FRAME_SIZE_BYTES, overflow=i == 0)
+        return capture, [await capture.read(), await capture.read()]
+
+    capture, frames = asyncio.run(run())
+    assert [frame[0] for frame in frames] == [3, 4]
+    assert (capture.dropped, capture.overflows) == (3, 1)
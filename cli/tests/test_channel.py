@@ -0,0 +1,52 @@
+import asyncio
+
+from channel import TranscriptionChannel
+
+
+def test_transcription_channel():
+    async def run():
+        channel = TranscriptionChannel(max_words=3)
+        assert not await channel.wait_for_update(0, timeout=0.01)
+
+        channel.publish(1.0, [(" hey", 0.9)])
+        assert await channel.wait_for_update(0, timeout=1)
+        assert (channel.end, channel.text) == (1, "hey")
+
+        channel.publish(2.0)
+        assert not await channel.wait_transcribed(2.5, timeout=0.1)
+        assert channel.text == "hey"
+
+        channel.publish(3.0, [(" peach", 0.8), (",", 0.7)])
+        assert await channel.wait_transcribed(2.5, timeout=1)
+        assert (channel.end, channel.text_after(1)) == (3, "peach,")
+        assert channel.probabilities_after(1) == [0.8, 0.7]
+
+        channel.publish(4.0, [(" what's", 0.9), (" up", 0.9)])
+        assert await channel.wait_for_update(3, timeout=1)
+        assert (channel.offset, channel.text) == (2, ", what's up")
+        assert channel.text_after(0) == channel.text
+
+    # the pipe is drained before anyone waits on the channel
+    async def drain():
+        channel = TranscriptionChannel(max_words=3)
+        channel.listen()
+        for i in range(1000):
+            channel.publish(float(i), [(" word", 0.9)])
+            await asyncio.sleep(0)
+        await asyncio.sleep(0.01)
+        assert (channel.transcribed_until, channel.end) == (999.0, 1000)
+
+    # the worker went away, waiting gives up right away instead of timing out
+    async def eof():
+        channel = TranscriptionChannel()
+        channel.publish(1.0, [(" hey", 0.9)])
+        channel.writer.close()
+        assert await channel.wait_for_update(0, timeout=1)
+        start = asyncio.get_running_loop().time()
+        assert not await channel.wait_for_update(1, timeout=5)
+        assert asyncio.get_running_loop().time() - start < 1
+        assert channel.closed and channel.reader.closed
+
+    asyncio.run(run())
+    asyncio.run(drain())
+    asyncio.run(eof())
@@ -0,0 +1,122 @@
+from realtime_whisper.core import (
+    Segment,
+    TranscriptArchive,
+    Transcription,
+    Word,
+    canonicalize_word,
+    common_prefix,
+    to_full_sentences,
+)
+
+
+def test_segment_is_eos():
+    assert not Segment("Hello").is_eos
+    assert not Segment("Hello...").is_eos
+    assert Segment("Hello.").is_eos
+    assert Segment("Hello!").is_eos
+    assert Segment("Hello?").is_eos
+    assert not Segment("Hello. Yo").is_eos
+    assert not Segment("Hello. Yo...").is_eos
+    assert Segment("Hello. Yo.").is_eos
+
+
+def test_to_full_sentences():
+    assert to_full_sentences([]) == []
+    assert to_full_sentences([Word(text="Hello")]) == []
+    assert to_full_sentences([Word(text="Hello..."), Word(" world")]) == []
+    assert to_full_sentences([Word(text="Hello..."), Word(" world.")]) == [
+        Segment(text="Hello... world.")
+    ]
+    assert to_full_sentences(
+        [Word(text="Hello..."), Word(" world."), Word(" How")]
+    ) == [Segment(text="Hello... world.")]
+
+
+def test_transcription_last_sentence():
+    words = [
+        Word(text=text, start=i, end=i + 0.5)
+        for i, text in enumerate(["Hi.", " How", " are", " you?", " I", " am..."])
+    ]
+    for split in range(len(words) + 1):
+        transcription = Transcription(words[:split])
+        transcription.extend(words[split:])
+        assert transcription.last_sentence == Segment(
+            text=" How are you?", start=1, end=3.5
+        )
+        expected = to_full_sentences(words)[-1]
+        assert transcription.last_sentence.text == expected.text
+        assert transcription.last_sentence.end == expected.end
+    assert Transcription(words[:3]).last_sentence == Segment(
+        text="Hi.", start=0, end=0.5
+    )
+    assert Transcription(words[1:3]).last_sentence is None
+
+
+def test_canonicalize_word():
+    assert canonicalize_word("ABC") == "abc"
+    assert canonicalize_word("...ABC?") == "abc"
+    assert canonicalize_word("... AbC  ...") == "abc"
+
+
+def test_common_prefix():
+    def word(text: str) -> Word:
+        return Word(text=text, start=0.0, end=0.0, probability=0.0)
+
+    a = [word("a"), word("b"), word("c")]
+    b = [word("a"), word("b"), word("c")]
+    assert common_prefix(a, b) == [word("a"), word("b"), word("c")]
+
+    a = [word("a"), word("b"), word("c")]
+    b = [word("a"), word("b"), word("d")]
+    assert common_prefix(a, b) == [word("a"), word("b")]
+
+    a = [word("a"), word("b"), word("c")]
+    b = [word("a")]
+    assert common_prefix(a, b) == [word("a")]
+
+    a = [word("a")]
+    b = [word("a"), word("b"), word("c")]
+    assert common_prefix(a, b) == [word("a")]
+
+    a = [word("a")]
+    b = []
+    assert common_prefix(a, b) == []
+
+    a = []
+    b = [word("a")]
+    assert common_prefix(a, b) == []
+
+    a = [word("a"), word("b"), word("c")]
+    b = [word("b"), word("c")]
+    assert common_prefix(a, b) == []
+
+
+def test_common_prefix_and_canonicalization():
+    def word(text: str) -> Word:
+        return Word(text=text, start=0.0, end=0.0, probability=0.0)
+
+    a = [word("A...")]
+    b = [word("a?"), word("b"), word("c")]
+    assert common_prefix(a, b) == [word("A...")]
+
+    a = [word("A..."), word("B?"), word("C,")]
+    b = [word("a??"), word("  b"), word(" ,c")]
+    assert common_prefix(a, b) == [word("A..."), word("B?"), word("C,")]
+
+
+def test_transcription_window(tmp_path):
+    archive = TranscriptArchive(str(tmp_path / "transcript.jsonl"))
+    transcription = Transcription(max_words=8, archive=archive)
+    words = [
+        Word(text=" end." if i % 4 == 3 else f" w{i}", start=i, end=i + 0.5)
+        for i in range(30)
+    ]
+    for i in range(0, len(words), 3):
+        transcription.extend(words[i : i + 3])
+        assert len(transcription) == min(i + 3, len(words))
+        assert len(transcription.words) <= 10
+
+    assert archive.read() + transcription.words == words
+    assert transcription.words[0] is words[transcription.offset]
+    assert transcription.text_after(26) == "w26 end. w28 w29"
+    assert transcription.last_sentence == Segment(" w24 w25 w26 end.", 24, 27.5)
@@ -0,0 +1,31 @@
+from intent import IntentFilter, load_fixtures, record_utterance
+
+
+def test_intent_filter():
+    examples = load_fixtures()
+    # every fourth utterance is held out, the filter is fitted on the rest
+    held_out = examples[::4]
+    intent_filter = IntentFilter()
+    intent_filter.fit([example for i, example in enumerate(examples) if i % 4])
+    decisions = [intent_filter.classify(text) for text, _ in held_out]
+    # a request the user made is never dropped
+    assert all(
+        decision != IntentFilter.DROP
+        for decision, (_, intent) in zip(decisions, held_out)
+        if intent
+    )
+    # and most false triggers never reach the api
+    negatives = [d for d, (_, intent) in zip(decisions, held_out) if not intent]
+    assert negatives.count(IntentFilter.DROP) / len(negatives) > 0.5
+    assert intent_filter.classify("peach") == IntentFilter.DROP
+    assert intent_filter.classify("") == IntentFilter.DROP
+
+
+def test_record_utterance(tmp_path):
+    path = str(tmp_path / "utterances.jsonl")
+    record_utterance(path, "Peach, hi.", [0.9, 0.8], IntentFilter.ESCALATE)
+    record_utterance(path, "a peach", [0.5, 0.4], IntentFilter.DROP)
+    with open(path) as file:
+        assert file.read().splitlines()[1] == (
+            '{"text": "a peach", "probabilities": [0.5, 0.4], "decision": "drop"}'
+        )
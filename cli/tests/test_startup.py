@@ -0,0 +1,13 @@
+from startup import StartupProfile
+
+
+def test_startup_profile():
+    profile = StartupProfile(origin=100.0)
+    profile.record("model load", 100.5, 102.0)
+    with profile.phase("api health"):
+        pass
+    assert profile.wait(["model load", "api health"], timeout=5.0)
+    assert profile.phases["model load"] == (0.5, 2.0)
+    assert profile.ready > 2.0
+    assert not profile.wait(["mic"], timeout=0.1)
+    assert profile.report().splitlines()[1].startswith("model load")
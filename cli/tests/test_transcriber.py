@@ -0,0 +1,38 @@
+from realtime_whisper.core import Transcription, Word
+from realtime_whisper.transcriber import AdaptiveWindow, prompt
+
+
+def test_adaptive_window():
+    window = AdaptiveWindow(
+        max_duration=20.0, commit_duration=10.0, commit_words=5, min_new_audio=1.0
+    )
+    confirmed = Transcription([Word(" one.", 0.0, 0.5), Word(" two", 1.0, 1.5)])
+    assert window.start(confirmed) == 0.5
+    assert window.commit(confirmed, 5.0) == 0.5
+
+    # too many words without a full stop
+    confirmed.extend([Word(f" w{i}", 2.0 + i, 2.5 + i) for i in range(4)])
+    assert window.commit(confirmed, 7.0) == 5.5
+    assert window.prompt(confirmed) == "two w0 w1 w2 w3"
+    assert window.forced_commits == 1
+
+    # too long without a full stop
+    confirmed.extend([Word(" w4", 6.0, 6.5)])
+    assert window.commit(confirmed, 12.0) == 5.5
+    assert window.commit(confirmed, 16.0) == 6.5
+    assert window.commit(confirmed, 16.5) == 6.5
+    # a full stop moves the start on its own
+    confirmed.extend([Word(" end.", 7.0, 7.5)])
+    assert window.start(confirmed) == 7.5
+    assert window.prompt(confirmed) == prompt(confirmed)
+
+    # nothing confirmed for longer than the window
+    assert window.commit(confirmed, 30.0) == 10.0
+    assert window.capped == 1
+
+    # a decode needs a second of new audio, or a tenth of a long window
+    assert window.should_decode(10.0, 31.0)
+    assert not window.should_decode(10.0, 32.0)
+    assert window.should_decode(10.0, 32.0, force=True)
+    assert not window.should_decode(10.0, 33.0)
+    assert window.should_decode(10.0, 34.5)
@@ -0,0 +1,19 @@
+import numpy as np
+
+from realtime_whisper.config import SAMPLES_PER_SECOND
+from realtime_whisper.vad import SpeechTagger
+
+
+def test_speech_tagger():
+    tagger = SpeechTagger()
+    tagger.process(np.zeros(SAMPLES_PER_SECOND, dtype=np.float32))
+    assert tagger.take() == 0.0
+
+    # a voiced, speech-like signal
+    t = np.arange(SAMPLES_PER_SECOND) / SAMPLES_PER_SECOND
+    voice = sum(np.sin(2 * np.pi * f * t) / i for i, f in enumerate([150, 300, 450], 1))
+    voice *= 0.3 * (1 + np.sin(2 * np.pi * 4 * t))
+    for start in range(0, SAMPLES_PER_SECOND, 174):
+        tagger.process(voice[start : start + 174].astype(np.float32))
+    assert tagger.take() > 0.5
+    assert tagger.take() == 0.0
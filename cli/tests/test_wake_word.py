@@ -0,0 +1,17 @@
+import numpy as np
+
+from wake_word import WakeWordGate
+
+
+def test_wake_word_gate():
+    class Detector:
+        def process(self, audio):
+            return bool(audio.any())
+
+    silence = np.zeros(10, dtype=np.float32)
+    gate = WakeWordGate(Detector(), hold=5.0)
+    assert not gate.process(silence, 1.0)
+    assert gate.process(silence + 1, 2.0)
+    assert gate.process(silence, 7.0)
+    assert not gate.process(silence, 8.0)
+    assert WakeWordGate(None).process(silence, 1.0)